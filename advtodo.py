@@ -0,0 +1,195 @@
+"""Точка входа командной строки.
+
+    python -m advtodo gui                  окно приложения (по умолчанию)
+    python -m advtodo daemon [--db PATH]   планирование и отправка писем без GUI
+    python -m advtodo import FILE          импорт напоминаний из CSV / JSONL
+    python -m advtodo export FILE          выгрузка в CSV / JSONL (--incremental -
+                                           только новые с прошлой выгрузки)
+    python -m advtodo group [NAME [EMAIL ...]]
+                                           группы адресатов: список, состав группы
+                                           или замена состава (--status - доставка
+                                           последней рассылки группе)
+
+Демон не импортирует Qt и работает на сервере без дисплея: он поднимает
+ReminderEngine, восстанавливает из базы запланированные письма и работает
+до SIGINT / SIGTERM, после чего дожидается писем, которые уже отправляются,
+и закрывает соединения.
+"""
+import argparse
+import logging
+import signal
+import sys
+import threading
+
+from dotenv import load_dotenv
+
+
+def run_daemon(args):
+    from db_connection import close_all
+    from engine import ReminderEngine
+
+    stop_requested = threading.Event()
+
+    def on_signal(signum, frame):
+        logging.info(f"Получен сигнал {signal.Signals(signum).name}, останавливаемся")
+        stop_requested.set()
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, on_signal)
+
+    # Не заданные в командной строке режим и окно дайджеста берутся
+    # из умолчаний engine / outbox (переменные окружения)
+    options = {}
+    if args.scheduler is not None:
+        options['mode'] = args.scheduler
+    if args.digest_window is not None:
+        options['digest_window'] = args.digest_window
+    engine = ReminderEngine(
+        daemon=False, metrics_port=args.metrics_port, metrics_file=args.metrics_file, **options
+    )
+    engine.add_listener(
+        on_sent=lambda job: logging.info(f"Письмо {job['id']} отправлено на {job['recipient']}"),
+        on_failed=lambda job, error: logging.error(
+            f"Письмо {job['id']} на {job['recipient']} не отправлено: {error}"
+        ),
+    )
+    engine.start()
+    try:
+        # wait с таймаутом, чтобы обработчик сигнала срабатывал сразу
+        while not stop_requested.wait(1):
+            pass
+    finally:
+        if engine.outbox is not None and engine.outbox.messages_saved:
+            logging.info(f"Дайджесты сэкономили писем: {engine.outbox.messages_saved}")
+        engine.stop(args.shutdown_timeout)
+        close_all()
+    return 0
+
+
+def run_gui(args):
+    import main
+    main.main()
+
+
+def run_import(args):
+    from importer import import_file
+
+    total, rate = import_file(args.path, args.chunk_size)
+    print(f"Импортировано {total} строк, {rate:.0f} строк/с")
+    return 0
+
+
+def run_export(args):
+    from exporter import export_file
+
+    total, rate = export_file(args.path, args.incremental, args.chunk_size)
+    print(f"Выгружено {total} строк, {rate:.0f} строк/с")
+    return 0
+
+
+def run_group(args):
+    import database
+
+    database.create_table()
+    if not args.name:
+        for name, members in database.list_groups():
+            print(f"{name}\t{members}")
+        return 0
+    if args.emails:
+        database.set_group(args.name, args.emails)
+        print(f"Группа {args.name}: {len(set(args.emails))} адресатов")
+        return 0
+    if database.get_group_id(args.name) is None:
+        print(f"Нет группы {args.name}", file=sys.stderr)
+        return 1
+    if not args.status:
+        print('\n'.join(database.group_members(args.name)))
+        return 0
+    job_id = database.last_group_job(args.name)
+    if job_id is None:
+        print(f"Группе {args.name} ещё ничего не отправлялось")
+        return 0
+    deliveries = database.job_deliveries(job_id)
+    for row in deliveries:
+        print(f"{row['recipient']}\t{row['status']}\t{row['attempts']}\t{row['last_error'] or ''}")
+    if not deliveries:
+        print(f"Рассылка {job_id} ещё не начиналась")
+    return 0
+
+
+def build_parser():
+    # engine и outbox (apscheduler, smtplib) импортирует только run_daemon:
+    # для gui и остальных команд они не нужны
+    from database import BULK_CHUNK_SIZE, EXPORT_CHUNK_SIZE
+    from metrics import METRICS_FILE, METRICS_PORT
+
+    parser = argparse.ArgumentParser(prog='advtodo', description="Advanced To-Do Editor")
+    # Общие опции принимаются и до, и после имени команды:
+    # advtodo --db PATH daemon и advtodo daemon --db PATH
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--db', default=argparse.SUPPRESS,
+                        help="файл базы данных (по умолчанию ADVTODO_DB или database.db)")
+    common.add_argument('--log-level', default=argparse.SUPPRESS)
+    parser.add_argument('--db', help="файл базы данных (по умолчанию ADVTODO_DB или database.db)")
+    parser.add_argument('--log-level', default='INFO')
+    commands = parser.add_subparsers(dest='command')
+
+    commands.add_parser('gui', parents=[common], help="окно приложения").set_defaults(
+        handler=run_gui)
+
+    daemon = commands.add_parser('daemon', parents=[common],
+                                 help="планирование и отправка писем без GUI")
+    daemon.add_argument('--shutdown-timeout', type=float, default=10,
+                        help="сколько секунд ждать писем, которые уже отправляются")
+    daemon.add_argument('--scheduler', choices=('jobs', 'timer'),
+                        help="jobs - задача на каждое письмо, timer - один таймер до ближайшего "
+                             "(по умолчанию ADVTODO_SCHEDULER или jobs)")
+    daemon.add_argument('--digest-window', type=int,
+                        help="объединять письма одному адресату в пределах окна, сек "
+                             "(по умолчанию ADVTODO_DIGEST_WINDOW или 0 - выкл.)")
+    daemon.add_argument('--metrics-port', type=int, default=METRICS_PORT,
+                        help="отдавать метрики Prometheus на localhost:PORT/metrics")
+    daemon.add_argument('--metrics-file', default=METRICS_FILE,
+                        help="переписывать файл с метриками Prometheus")
+    daemon.set_defaults(handler=run_daemon)
+
+    importer = commands.add_parser('import', parents=[common],
+                                   help="импорт напоминаний из CSV / JSONL")
+    importer.add_argument('path', help="файл .csv или .jsonl")
+    importer.add_argument('--chunk-size', type=int, default=BULK_CHUNK_SIZE)
+    importer.set_defaults(handler=run_import)
+
+    exporter = commands.add_parser('export', parents=[common],
+                                   help="выгрузка напоминаний в CSV / JSONL")
+    exporter.add_argument('path', help="файл .csv или .jsonl")
+    exporter.add_argument('--incremental', action='store_true',
+                          help="дописать только напоминания, добавленные после прошлой выгрузки")
+    exporter.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+    exporter.set_defaults(handler=run_export)
+
+    group = commands.add_parser('group', parents=[common],
+                                help="группы адресатов для рассылки напоминаний")
+    group.add_argument('name', nargs='?', help="имя группы (без @)")
+    group.add_argument('emails', nargs='*', help="новый состав группы")
+    group.add_argument('--status', action='store_true',
+                       help="статус доставки последней рассылки каждому адресату")
+    group.set_defaults(handler=run_group)
+    return parser
+
+
+def main(argv=None):
+    load_dotenv()
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(
+        level=getattr(logging, args.log_level.upper(), logging.INFO),
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+    if args.db:
+        import db_connection
+        db_connection.configure(args.db)
+    handler = getattr(args, 'handler', run_gui)
+    return handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+"""Бенчмарк экспорта в PDF: последовательная разметка против пула процессов.
+
+Создаёт временную базу с синтетическими напоминаниями и строит один и тот же
+PDF через render_pdf и через render_pdf_parallel с разным числом процессов.
+Ускорение ограничено числом ядер: на одноядерной машине параллельный режим
+выигрывает только за счёт того, что чтение базы и склейка идут рядом с разметкой.
+
+    python benchmarks/bench_export.py --rows 100000 --workers 1 2 4 8 --json export.json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db_connection  # noqa: E402
+
+from bench_suite import generate_reminders  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк параллельного экспорта в PDF")
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    parser.add_argument('--fragment-rows', type=int, default=None)
+    parser.add_argument('--json', help="сохранить результат в файл")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_connection.configure(os.path.join(tmp, 'bench.db'))
+        import database
+        import pdf_export
+
+        database.create_table()
+        database.insert_deadlines(generate_reminders(args.rows))
+        fragment_rows = args.fragment_rows or pdf_export.FRAGMENT_ROWS
+
+        def run(render, **kwargs):
+            out = os.path.join(tmp, 'export.pdf')
+            started = time.perf_counter()
+            render(out, database.iter_reminders_for_export(), args.rows, **kwargs)
+            return time.perf_counter() - started, os.path.getsize(out)
+
+        serial_s, serial_size = run(pdf_export.render_pdf)
+        print(f"Строк: {args.rows}, ядер: {os.cpu_count()}")
+        print(f"  последовательно        {serial_s:7.2f} с")
+        runs = []
+        for workers in args.workers:
+            seconds, size = run(pdf_export.render_pdf_parallel, workers=workers,
+                                rows_per_fragment=fragment_rows)
+            runs.append({'workers': workers, 'seconds': seconds, 'speedup': serial_s / seconds,
+                         'pdf_bytes': size})
+            print(f"  процессов: {workers:<3}         {seconds:7.2f} с  x{serial_s / seconds:.2f}")
+        db_connection.close_all()
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({
+                'rows': args.rows,
+                'cpu_count': os.cpu_count(),
+                'fragment_rows': fragment_rows,
+                'serial_s': serial_s,
+                'serial_pdf_bytes': serial_size,
+                'parallel': runs,
+            }, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Бенчмарк поиска: FTS5-индекс против LIKE с полным просмотром таблицы.
+
+Создаёт временную базу с синтетическими напоминаниями и замеряет задержку
+первой страницы результатов для нескольких запросов.
+
+    python benchmarks/bench_search.py --rows 1000000 --json search.json
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db_connection  # noqa: E402
+
+SYLLABLES = ['ка', 'ло', 'ми', 'ра', 'то', 'се', 'ну', 'ви', 'да', 'пе', 'зо', 'лу', 'бы', 'ще']
+SELECT_LIKE = """select id, name, description, deadline from advToDo
+        where name like ? or description like ?
+        order by deadline desc
+        limit ?"""
+
+
+def make_vocabulary(size, rnd):
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(2, 4))))
+    return sorted(words)
+
+
+def generate_rows(count, vocabulary, rnd, start=1800000000):
+    for i in range(count):
+        name = ' '.join(rnd.choices(vocabulary, k=3))
+        description = ' '.join(rnd.choices(vocabulary, k=8)) if i % 3 else None
+        yield name, description, start + i * 60
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк полнотекстового поиска")
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', help="сохранить результат в файл")
+    args = parser.parse_args()
+
+    rnd = random.Random(42)
+    vocabulary = make_vocabulary(5000, rnd)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_connection.configure(os.path.join(tmp, 'bench.db'))
+        import database
+
+        database.create_table()
+        started = time.perf_counter()
+        database.insert_deadlines(generate_rows(args.rows, vocabulary, rnd))
+        load_s = time.perf_counter() - started
+
+        results = []
+        # Слово, которого нет в базе, - худший случай для LIKE (полный просмотр)
+        for word in rnd.sample(vocabulary, args.queries) + ['отсутствует']:
+            pattern = f"%{word}%"
+
+            def like():
+                with db_connection.connection() as conn:
+                    return conn.execute(SELECT_LIKE, (pattern, pattern, 50)).fetchall()
+
+            def fts():
+                return database.search_reminders(word, 50)
+
+            results.append({
+                'query': word,
+                'like_ms': timed(like, args.repeat),
+                'fts_ms': timed(fts, args.repeat),
+            })
+        db_connection.close_all()
+
+    result = {
+        'rows': args.rows,
+        'load_s': load_s,
+        'like_ms': statistics.median(r['like_ms'] for r in results),
+        'fts_ms': statistics.median(r['fts_ms'] for r in results),
+        'queries': results,
+    }
+    print(f"Строк: {args.rows}, загрузка с индексом FTS5: {load_s:.1f} с")
+    for r in results:
+        print(f"  {r['query']:<12} LIKE {r['like_ms']:8.1f} мс   FTS5 {r['fts_ms']:6.2f} мс")
+    print(f"Медиана: LIKE {result['like_ms']:.1f} мс, FTS5 {result['fts_ms']:.2f} мс")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Бенчмарк запуска приложения: время импорта main и до первой отрисовки окна.
+
+Каждый замер выполняется в отдельном процессе с платформой Qt offscreen и
+временной базой, результат - медиана по нескольким запускам.
+
+    python benchmarks/bench_startup.py --runs 5 --json startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Выполняется в дочернем процессе: печатает JSON с замерами
+PROBE = r'''
+import json, sys, time
+started = time.perf_counter()
+sys.path.insert(0, ROOT)
+import main
+imported = time.perf_counter()
+
+from PyQt5 import QtCore, QtWidgets
+
+HEAVY = ('apscheduler', 'fpdf', 'reportlab', 'smtplib', 'pytz')
+
+class FirstPaint(QtCore.QObject):
+    painted = None
+    def eventFilter(self, obj, event):
+        if event.type() == QtCore.QEvent.Paint and self.painted is None:
+            self.painted = time.perf_counter()
+            self.loaded = sorted(m for m in HEAVY if m in sys.modules)
+            QtCore.QTimer.singleShot(0, app.quit)
+        return False
+
+app = QtWidgets.QApplication(sys.argv)
+probe = FirstPaint()
+window = main.EmailSenderApp()
+window.installEventFilter(probe)
+window.show()
+app.exec_()
+window.shutdown_services()
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_paint_ms': (probe.painted - started) * 1000,
+    'eager_modules': probe.loaded,
+}))
+'''
+
+
+def run_once(db_path):
+    env = dict(os.environ, QT_QPA_PLATFORM='offscreen', ADVTODO_DB=db_path)
+    out = subprocess.run(
+        [sys.executable, '-c', f"ROOT = {ROOT!r}\n" + PROBE],
+        env=env, capture_output=True, text=True, check=True, cwd=ROOT
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк запуска Advanced To Do")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--json', help="сохранить результат в файл")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        samples = [run_once(os.path.join(tmp, 'database.db')) for _ in range(args.runs)]
+
+    result = {
+        'runs': args.runs,
+        'import_ms': statistics.median(s['import_ms'] for s in samples),
+        'first_paint_ms': statistics.median(s['first_paint_ms'] for s in samples),
+        'eager_modules': samples[-1]['eager_modules'],
+    }
+    print(f"Импорт main:            {result['import_ms']:.0f} мс")
+    print(f"До первой отрисовки:    {result['first_paint_ms']:.0f} мс")
+    print(f"Загружены до отрисовки: {', '.join(result['eager_modules']) or 'нет'}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+"""Набор микробенчмарков: запись в базу, планирование, экспорт в PDF, история.
+
+Для каждого размера (по умолчанию 1k / 100k / 1M напоминаний) создаётся
+временная база с синтетическими данными, затем каждый сценарий выполняется
+в отдельном процессе, чтобы пиковая память (ru_maxrss) относилась только
+к нему:
+
+    insert    вставка по одной строке (insert_deadline) и пакетная (insert_deadlines)
+    schedule  планирование писем через движок и запуск движка с N ожидающими
+              письмами в режимах timer и jobs
+    export    экспорт в PDF: время и пиковая память
+    history   модель истории в QListView на платформе offscreen: первая
+              страница, добавление напоминаний, прокрутка
+
+Результат сохраняется в JSON; --compare печатает изменение относительно
+прошлого запуска:
+
+    python benchmarks/bench_suite.py --json bench.json
+    python benchmarks/bench_suite.py --sizes 1000 100000 --compare bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SIZES = (1000, 100000, 1000000)
+CASES = ('insert', 'schedule', 'export', 'history')
+PER_ROW_LIMIT = 10000       # построчные операции дольше - замеряем на первых N
+EXPORT_MAX_ROWS = 100000    # fpdf держит весь документ в памяти
+JOBS_MODE_MAX = 100000      # режим jobs создаёт задачу APScheduler на каждое письмо
+START = 1800000000          # все сроки в будущем, чтобы ничего не отправлялось
+
+WORDS = ['отчёт', 'встреча', 'созвон', 'оплата', 'проект', 'релиз', 'ревью', 'сдача',
+         'лекция', 'экзамен', 'договор', 'счёт', 'врач', 'билеты', 'налог', 'план']
+
+
+def generate_reminders(count, seed=42, start=START):
+    """Синтетические напоминания (name, description, deadline epoch)"""
+    rnd = random.Random(seed)
+    for i in range(count):
+        name = ' '.join(rnd.choices(WORDS, k=3))
+        description = ' '.join(rnd.choices(WORDS, k=10)) if i % 4 else None
+        yield name, description, start + rnd.randrange(0, 365 * 86400)
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def timed(fn):
+    started = time.perf_counter()
+    value = fn()
+    return time.perf_counter() - started, value
+
+
+# --- Сценарии (выполняются в дочернем процессе) ---
+
+def case_seed(size, db_path):
+    import database
+
+    database.create_table()
+    seconds, _ = timed(lambda: database.insert_deadlines(generate_reminders(size)))
+    return {'seed_s': seconds}
+
+
+def case_insert(size, db_path):
+    import database
+
+    database.create_table()
+    per_row = min(size, PER_ROW_LIMIT)
+    rows = generate_reminders(per_row, seed=1)
+    single_s, _ = timed(lambda: [database.insert_deadline(*row) for row in rows])
+    bulk_s, _ = timed(lambda: database.insert_deadlines(generate_reminders(size, seed=2)))
+    return {
+        'single_rows': per_row,
+        'single_rows_per_s': per_row / single_s,
+        'bulk_s': bulk_s,
+        'bulk_rows_per_s': size / bulk_s,
+    }
+
+
+def case_schedule(size, db_path):
+    import database
+    import engine
+    from db_connection import connection
+
+    with connection() as conn:
+        reminders = conn.execute(
+            "select id, deadline from advToDo order by id limit ?", (PER_ROW_LIMIT,)
+        ).fetchall()
+
+    result = {}
+    timer = engine.ReminderEngine(mode='timer')
+    timer.start()
+    seconds, _ = timed(lambda: [
+        timer.schedule(rid, 'bench@example.com', deadline, 's', 'b') for rid, deadline in reminders
+    ])
+    timer.stop()
+    result['schedule_jobs'] = len(reminders)
+    result['schedule_jobs_per_s'] = len(reminders) / seconds
+
+    # Остальные письма - одним запросом, чтобы ожидающих было size
+    with database.transaction() as conn:
+        conn.execute("""insert or ignore into email_jobs(reminder_id, recipient, run_at, subject, body)
+            select id, 'bench@example.com', deadline, 's', 'b' from advToDo""")
+
+    for mode in ('timer', 'jobs'):
+        if mode == 'jobs' and size > JOBS_MODE_MAX:
+            continue
+        # Половина писем - в ближайшем окне, чтобы режим jobs создал для них задачи
+        with database.transaction() as conn:
+            conn.execute("update email_jobs set run_at = ? + id % 600 where id % 2 = 0",
+                         (int(time.time()) + 60,))
+        eng = engine.ReminderEngine(mode=mode)
+        seconds, _ = timed(eng.start)
+        result[f'start_{mode}_s'] = seconds
+        result[f'scheduler_jobs_{mode}'] = len(eng.scheduler.get_jobs())
+        eng.stop()
+    result['pending_jobs'] = size
+    return result
+
+
+def case_export(size, db_path):
+    import database
+    import pdf_export
+
+    rows = min(size, EXPORT_MAX_ROWS)
+    if rows < size:
+        with database.transaction() as conn:
+            conn.execute("delete from advToDo where id > ?", (rows,))
+    baseline = peak_rss_mb()
+    out = os.path.join(os.path.dirname(db_path), 'export.pdf')
+    seconds, done = timed(lambda: pdf_export.render_pdf(
+        out, database.iter_reminders_for_export(), rows
+    ))
+    return {
+        'export_rows': done,
+        'export_s': seconds,
+        'export_rows_per_s': done / seconds,
+        'export_peak_delta_mb': peak_rss_mb() - baseline,
+        'pdf_mb': os.path.getsize(out) / 2 ** 20,
+    }
+
+
+def case_history(size, db_path):
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5 import QtWidgets
+    from history_model import ReminderHistoryModel
+
+    app = QtWidgets.QApplication([])
+    view = QtWidgets.QListView()
+    view.setUniformItemSizes(True)
+    view.resize(400, 600)
+
+    def first_page():
+        model = ReminderHistoryModel(view)
+        view.setModel(model)
+        view.show()
+        app.processEvents()
+        return model
+
+    first_page_s, model = timed(first_page)
+
+    added = 1000
+
+    def add_reminders(count=added):
+        for i in range(count):
+            model.prepend(size + i + 1, f"новое {i}", "описание", START)
+            app.processEvents()
+
+    prepend_s, _ = timed(add_reminders)
+
+    def scroll(pages=20):
+        for _ in range(pages):
+            if not model.canFetchMore():
+                break
+            model.fetchMore()
+            view.scrollToBottom()
+            app.processEvents()
+        return model.rowCount()
+
+    scroll_s, loaded = timed(scroll)
+    view.close()
+    return {
+        'first_page_ms': first_page_s * 1000,
+        'prepend_ms_per_item': prepend_s * 1000 / added,
+        'scroll_20_pages_ms': scroll_s * 1000,
+        'rows_loaded': loaded,
+    }
+
+
+CASE_FUNCTIONS = {
+    'seed': case_seed,
+    'insert': case_insert,
+    'schedule': case_schedule,
+    'export': case_export,
+    'history': case_history,
+}
+
+
+def run_case(case, size, db_path):
+    """Дочерний процесс: выполняет сценарий и печатает JSON с замерами"""
+    import db_connection
+
+    db_connection.configure(db_path)
+    result = CASE_FUNCTIONS[case](size, db_path)
+    db_connection.close_all()
+    result['peak_rss_mb'] = peak_rss_mb()
+    print(json.dumps(result))
+
+
+# --- Запуск набора ---
+
+def spawn(case, size, db_path):
+    env = dict(os.environ, QT_QPA_PLATFORM='offscreen', ADVTODO_DB=db_path)
+    out = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--case', case,
+         '--size', str(size), '--db', db_path],
+        env=env, capture_output=True, text=True, cwd=ROOT
+    )
+    if out.returncode != 0:
+        return {'error': out.stderr.strip().splitlines()[-1] if out.stderr.strip() else 'failed'}
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def copy_db(src, dst):
+    """Копия базы с синтетикой (через backup, чтобы учесть WAL)"""
+    import sqlite3
+
+    with sqlite3.connect(src) as source, sqlite3.connect(dst) as target:
+        source.backup(target)
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = {(r['case'], r['size']): r for r in json.load(f)['results']}
+    print(f"\nСравнение с {baseline_path}:")
+    for r in results:
+        old = baseline.get((r['case'], r['size']))
+        if old is None:
+            continue
+        for key, value in r.items():
+            if key in ('case', 'size') or not isinstance(value, (int, float)):
+                continue
+            before = old.get(key)
+            if isinstance(before, (int, float)) and before:
+                print(f"  {r['case']:<8} {r['size']:>8} {key:<24} "
+                      f"{before:12.3f} -> {value:12.3f}  ({(value / before - 1) * 100:+.0f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Набор микробенчмарков")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES))
+    parser.add_argument('--cases', nargs='+', choices=CASES, default=list(CASES))
+    parser.add_argument('--json', help="сохранить результат в файл")
+    parser.add_argument('--compare', help="JSON прошлого запуска для сравнения")
+    parser.add_argument('--case', choices=sorted(CASE_FUNCTIONS), help=argparse.SUPPRESS)
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--db', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        run_case(args.case, args.size, args.db)
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            seed_db = os.path.join(tmp, f'seed_{size}.db')
+            seed = spawn('seed', size, seed_db)
+            print(f"{size} напоминаний: синтетика за {seed.get('seed_s', 0):.1f} с")
+            for case in args.cases:
+                db_path = os.path.join(tmp, f'{case}_{size}.db')
+                if case != 'insert':
+                    copy_db(seed_db, db_path)
+                result = dict(case=case, size=size, **spawn(case, size, db_path))
+                results.append(result)
+                print(f"  {case:<8} " + ', '.join(
+                    f"{key}={value:.3g}" if isinstance(value, float) else f"{key}={value}"
+                    for key, value in result.items() if key not in ('case', 'size')
+                ))
+                for path in (db_path, db_path + '-wal', db_path + '-shm'):
+                    if os.path.exists(path):
+                        os.remove(path)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+        },
+        'results': results,
+    }
+    if args.compare:
+        compare(results, args.compare)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
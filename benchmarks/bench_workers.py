@@ -0,0 +1,137 @@
+"""Несколько экземпляров диспетчера писем на одной базе.
+
+Создаёт временную базу с N наступившими письмами и запускает P процессов
+с OutboxDispatcher. Вместо SMTP каждое «отправленное» письмо дописывается
+строкой в общий журнал, отправка занимает --send-time секунд. С --kill
+первый процесс через секунду убивается (SIGKILL) посреди отправки:
+его письма должны перейти к остальным после истечения аренды.
+
+В конце печатается время, распределение писем по процессам, число
+повторных отправок (письмо в журнале дважды) и потерянных писем.
+
+    python benchmarks/bench_workers.py --jobs 500 --workers 1 2 4
+    python benchmarks/bench_workers.py --jobs 500 --workers 3 --kill
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db_connection  # noqa: E402
+
+from bench_suite import generate_reminders  # noqa: E402
+
+
+def worker(db_path, log_path, name, concurrency, send_time, lease_ttl):
+    db_connection.configure(db_path)
+    import database
+    import outbox
+
+    def deliver(job):
+        time.sleep(send_time)
+        with open(log_path, 'a', encoding='utf-8') as f:
+            f.write(f"{job['id']} {name}\n")
+
+    dispatcher = outbox.OutboxDispatcher(
+        deliver=deliver, provider=lambda job: 'bench', concurrency=concurrency,
+        rate_per_minute=10 ** 9, worker_id=name, lease_ttl=lease_ttl,
+    )
+    dispatcher.start()
+    while True:
+        by_status = database.job_status_counts()
+        if not any(by_status.get(status) for status in ('pending', 'queued', 'sending')):
+            break
+        time.sleep(0.1)
+    dispatcher.stop()
+
+
+def run(db_path, jobs, workers, concurrency, send_time, lease_ttl, kill):
+    import database
+
+    log_path = f"{db_path}.log"
+    with db_connection.transaction() as conn:
+        conn.execute("DELETE FROM email_jobs")
+        ids = [row[0] for row in conn.execute("SELECT id FROM advToDo LIMIT ?", (jobs,))]
+    open(log_path, 'w').close()
+    now = time.time()
+    for reminder_id in ids:
+        database.add_email_job(reminder_id, 'bench@example.com', now - 1, 'subject', 'body')
+    database.enqueue_overdue_jobs(now)
+
+    context = multiprocessing.get_context('spawn')
+    processes = [
+        context.Process(target=worker, args=(db_path, log_path, f"w{i}", concurrency,
+                                             send_time, lease_ttl))
+        for i in range(workers)
+    ]
+    started = time.perf_counter()
+    for process in processes:
+        process.start()
+    if kill:
+        time.sleep(1)
+        os.kill(processes[0].pid, signal.SIGKILL)
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - started
+
+    with open(log_path, encoding='utf-8') as f:
+        lines = [line.split() for line in f if line.strip()]
+    sends = Counter(int(job_id) for job_id, _ in lines)
+    with db_connection.connection() as conn:
+        job_ids = {row[0] for row in conn.execute("SELECT id FROM email_jobs")}
+        sent = conn.execute("SELECT count(*) FROM email_jobs WHERE status = 'sent'").fetchone()[0]
+    return {
+        'jobs': len(job_ids),
+        'workers': workers,
+        'killed': kill,
+        'seconds': elapsed,
+        'per_second': len(sends) / elapsed,
+        'by_worker': dict(Counter(name for _, name in lines)),
+        'marked_sent': sent,
+        'duplicates': sum(count - 1 for count in sends.values()),
+        'lost': len(job_ids - set(sends)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Несколько диспетчеров писем на одной базе")
+    parser.add_argument('--jobs', type=int, default=500)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--concurrency', type=int, default=3)
+    parser.add_argument('--send-time', type=float, default=0.02)
+    parser.add_argument('--lease-ttl', type=float, default=3)
+    parser.add_argument('--kill', action='store_true', help="убить первый процесс через секунду")
+    parser.add_argument('--json', help="сохранить результат в файл")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        db_connection.configure(db_path)
+        import database
+
+        database.create_table()
+        database.insert_deadlines(generate_reminders(args.jobs))
+        for workers in args.workers:
+            result = run(db_path, args.jobs, workers, args.concurrency, args.send_time,
+                         args.lease_ttl, args.kill)
+            results.append(result)
+            print(f"процессов: {workers:<3} {result['seconds']:6.2f} с  "
+                  f"{result['per_second']:7.1f} писем/с  повторов: {result['duplicates']}  "
+                  f"потеряно: {result['lost']}  по процессам: {result['by_worker']}")
+        db_connection.close_all()
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
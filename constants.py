@@ -29,13 +29,22 @@ TEXTS = {
     'name_label': 'Краткое название для напоминания',
     'details_label': 'Подробное описание:', 
     'notification_text': 'Получить уведомление',
-    'email_label': 'Email получателя:',
-    'email_placeholder': 'example@email.com',
+    'email_label': 'Email или группа:',
+    'email_placeholder': 'example@email.com или имя группы',
     'send_button': 'Отправить',
     'body_placeholder': 'Здесь будут отображаться ваши напоминания',
-    'details_placeholder': 'Подробное описание (необязательно)' 
+    'details_placeholder': 'Подробное описание (необязательно)',
+    'search_placeholder': 'Поиск по напоминаниям'
 }
 
+# Варианты повтора напоминания: (подпись, правило RRULE)
+RECURRENCE_OPTIONS = (
+    ('Без повтора', None),
+    ('Каждый день', 'FREQ=DAILY'),
+    ('Каждую неделю', 'FREQ=WEEKLY'),
+    ('Каждый месяц', 'FREQ=MONTHLY'),
+)
+
 # Размеры
 WINDOW_SIZE = QtCore.QSize(1100, 650)  # Увеличил размер окна
 PADDING = 20
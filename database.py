@@ -1,28 +1,509 @@
-import sqlite3
+from datetime import datetime
+from itertools import islice
 
-def create_table():
-    connection = sqlite3.connect('database.db')
-    try:
-        query = """Create table if not exists advToDo
-        (
-            id INTEGER PRIMARY KEY,
-            name Not Null,
-            description,
-            date Not Null
+from db_connection import connection, transaction
+from migrations import migrate
+from recurrence import parse_rule
+
+
+# Статусы напоминания в колонке status
+STATUS_PENDING = 'pending'
+STATUS_QUEUED = 'queued'
+STATUS_SENDING = 'sending'
+STATUS_SENT = 'sent'
+STATUS_FAILED = 'failed'
+STATUS_DONE = 'done'
+
+INSERT_DEADLINE = "insert into advToDo(name, description, deadline) values(?,?,?)"
+INSERT_RECURRING_DEADLINE = """insert into advToDo(name, description, deadline, recurrence, dtstart)
+        values(?,?,?,?,?)"""
+# Размер пачки для insert_deadlines: одна транзакция на пачку
+BULK_CHUNK_SIZE = 5000
+
+SELECT_REMINDER_COUNT = "select count(*) from advToDo"
+SELECT_REMINDERS_FOR_EXPORT = """select name, description, deadline from advToDo
+        order by deadline desc"""
+# Сколько строк за раз читать из курсора при потоковом экспорте
+EXPORT_CHUNK_SIZE = 500
+# Строки, добавленные после отметки (диапазон по первичному ключу)
+SELECT_REMINDERS_SINCE = """select id, name, description, deadline, status, recurrence
+        from advToDo
+        where id > ?
+        order by id"""
+SELECT_WATERMARK = "select last_id from export_watermarks where target = ?"
+UPSERT_WATERMARK = """insert into export_watermarks(target, last_id, updated_at) values(?,?,?)
+        on conflict(target) do update set
+            last_id = excluded.last_id, updated_at = excluded.updated_at"""
+
+# Страница истории: от новых к старым, keyset-пагинация по первичному ключу
+SELECT_HISTORY_PAGE = """select id, name, description, deadline from advToDo
+        where id < ?
+        order by id desc
+        limit ?"""
+
+# Полнотекстовый поиск: лучшие по bm25 совпадения, страница за страницей
+SELECT_SEARCH = """select a.id, a.name, a.description, a.deadline
+        from advToDo_fts
+        join advToDo a on a.id = advToDo_fts.rowid
+        where advToDo_fts match ?
+        order by advToDo_fts.rank
+        limit ? offset ?"""
+
+SELECT_DUE_BETWEEN = """select id, name, description, deadline, status from advToDo
+        where deadline >= ? and deadline < ?
+        order by deadline"""
+SELECT_DUE_BETWEEN_STATUS = """select id, name, description, deadline, status from advToDo
+        where status = ? and deadline >= ? and deadline < ?
+        order by deadline"""
+SELECT_NEXT_PENDING = """select id, name, description, deadline, status from advToDo
+        where status = 'pending' and deadline >= ?
+        order by deadline
+        limit ?"""
+
+
+UPSERT_EMAIL_JOB = """insert into email_jobs(reminder_id, recipient, run_at, subject, body, message,
+            group_id)
+        values(?,?,?,?,?,?,?)
+        on conflict(reminder_id, recipient) do update set
+            run_at = excluded.run_at, subject = excluded.subject,
+            body = excluded.body, message = excluded.message, group_id = excluded.group_id,
+            status = 'pending', sent_at = null,
+            attempts = 0, next_attempt_at = null, last_error = null
+        returning id"""
+SELECT_EMAIL_JOB = "select * from email_jobs where id = ?"
+# Статусы адресатов рассылки сбрасываются при каждом (пере)планировании письма
+DELETE_JOB_DELIVERIES = "delete from email_deliveries where job_id = ?"
+
+# Группы адресатов: письмо группе уходит каждому участнику (см. outbox.py)
+UPSERT_GROUP = """insert into recipient_groups(name) values(?)
+        on conflict(name) do update set name = excluded.name
+        returning id"""
+DELETE_GROUP_MEMBERS = "delete from group_members where group_id = ?"
+INSERT_GROUP_MEMBER = "insert or ignore into group_members(group_id, email) values(?,?)"
+SELECT_GROUP_ID = "select id from recipient_groups where name = ?"
+SELECT_GROUPS = """select g.name, count(m.email) from recipient_groups g
+        left join group_members m on m.group_id = g.id
+        group by g.id
+        order by g.name"""
+SELECT_GROUP_MEMBERS = """select m.email from group_members m
+        join recipient_groups g on g.id = m.group_id
+        where g.name = ?
+        order by m.email"""
+# Рассылка разворачивается в строки email_deliveries при первой попытке;
+# повторные попытки идут только адресатам, которым письмо ещё не ушло
+EXPAND_GROUP_JOB = """insert or ignore into email_deliveries(job_id, recipient)
+        select ?, email from group_members where group_id = ?"""
+SELECT_PENDING_DELIVERIES = """select recipient from email_deliveries
+        where job_id = ? and status = 'pending'
+        order by recipient"""
+UPDATE_DELIVERY_SENT = """update email_deliveries set status = 'sent', sent_at = ?,
+        attempts = attempts + 1, last_error = null
+        where job_id = ? and recipient = ?"""
+UPDATE_DELIVERY_RETRY = """update email_deliveries set attempts = attempts + 1, last_error = ?
+        where job_id = ? and recipient = ?"""
+UPDATE_DELIVERY_FAILED = """update email_deliveries set status = 'failed',
+        attempts = attempts + 1, last_error = ?
+        where job_id = ? and recipient = ?"""
+FAIL_PENDING_DELIVERIES = """update email_deliveries set status = 'failed', last_error = ?
+        where job_id = ? and status = 'pending'"""
+SELECT_DELIVERY_COUNTS = """select status, count(*) from email_deliveries
+        where job_id = ?
+        group by status"""
+SELECT_DELIVERIES = """select recipient, status, sent_at, attempts, last_error
+        from email_deliveries
+        where job_id = ?
+        order by recipient"""
+SELECT_LAST_GROUP_JOB = """select j.id from email_jobs j
+        join recipient_groups g on g.id = j.group_id
+        where g.name = ?
+        order by j.run_at desc
+        limit 1"""
+SELECT_JOBS_DUE_BETWEEN = """select id, run_at from email_jobs
+        where status = 'pending' and run_at > ? and run_at <= ?
+        order by run_at"""
+SELECT_NEXT_RUN_AT = "select min(run_at) from email_jobs where status = 'pending'"
+
+# Очередь исходящих писем: pending -> queued -> sending -> sent / failed.
+# Отправляемое письмо арендовано экземпляром (lease_owner) до lease_expires;
+# письмо с истёкшей арендой (экземпляр упал) забирает любой другой
+ENQUEUE_JOB = """update email_jobs set status = 'queued', next_attempt_at = ?
+        where id = ? and status = 'pending' and run_at <= ?"""
+ENQUEUE_OVERDUE_JOBS = """update email_jobs set status = 'queued', next_attempt_at = ?
+        where status = 'pending' and run_at <= ?"""
+# Каждая ветка идёт по своему индексу и читает не больше limit строк
+# (условие через or свело бы их в сортировку всех готовых писем);
+# письма с истёкшей арендой - первыми, они ждут дольше всех
+CLAIM_READY_JOBS = """update email_jobs set status = 'sending', lease_owner = ?, lease_expires = ?
+        where id in (
+            select id from (
+                select id from (
+                    select id from email_jobs
+                    where status = 'sending' and lease_expires <= ?
+                    order by lease_expires
+                    limit ?
+                )
+                union all
+                select id from (
+                    select id from email_jobs
+                    where status = 'queued' and next_attempt_at <= ?
+                    order by next_attempt_at
+                    limit ?
+                )
+            )
+            limit ?
         )
-        """
-        cur = connection.cursor()
-        cur.execute(query)
-        connection.commit()
-    finally:
-        connection.close()
-
-def insert_deadline(name, desc, date):
-    connection = sqlite3.connect('database.db')
-    try:
-        query = "insert into advToDo(name, description, date) values(?,?,?)"
-        cur = connection.cursor()
-        cur.execute(query, (name, desc, date))
-        connection.commit()
-    finally:
-        connection.close()
\ No newline at end of file
+        returning *"""
+# Дайджест: остальные письма тому же адресату, готовые сейчас или в пределах окна
+# Обе ветки - по индексу (recipient, status, run_at): иначе для queued
+# планировщик берёт (status, next_attempt_at) и перебирает всех адресатов
+CLAIM_DIGEST_JOBS = """update email_jobs set status = 'sending', lease_owner = ?, lease_expires = ?
+        where id in (
+            select id from (
+                select id, run_at from (
+                    select id, run_at from email_jobs indexed by idx_email_jobs_recipient_status
+                    where recipient = ? and status = 'queued' and next_attempt_at <= ?
+                    order by run_at
+                    limit ?
+                )
+                union all
+                select id, run_at from (
+                    select id, run_at from email_jobs
+                    where recipient = ? and status = 'pending' and run_at <= ?
+                    order by run_at
+                    limit ?
+                )
+            )
+            order by run_at
+            limit ?
+        )
+        returning *"""
+# Повторяющиеся напоминания: одно письмо перепланируется на следующее наступление
+SELECT_RECURRENCE = "select name, recurrence, dtstart from advToDo where id = ?"
+UPDATE_REMINDER_DEADLINE = """update advToDo set deadline = ?, status = 'pending'
+        where id = ? and deadline < ?"""
+SELECT_FINISHED_RECURRING_JOBS = """select j.* from email_jobs j
+        join advToDo r on r.id = j.reminder_id
+        where r.recurrence is not null and j.status in ('sent', 'failed')"""
+# Ближайшая попытка в очереди или истечение чужой аренды
+SELECT_NEXT_ATTEMPT = """select min(at) from (
+            select min(next_attempt_at) as at from email_jobs where status = 'queued'
+            union all
+            select min(lease_expires) from email_jobs where status = 'sending'
+        )"""
+RENEW_LEASES = """update email_jobs set lease_expires = ?
+        where id = ? and status = 'sending' and lease_owner = ?"""
+RELEASE_LEASES = """update email_jobs set status = 'queued', lease_expires = null
+        where status = 'sending' and lease_owner = ?"""
+# Итог отправки записывает только текущий арендатор письма
+UPDATE_JOB_SENT = """update email_jobs set status = 'sent', sent_at = ?,
+        attempts = attempts + 1, last_error = null
+        where id = ? and status = 'sending' and lease_owner = ?"""
+UPDATE_JOB_RETRY = """update email_jobs set status = 'queued', next_attempt_at = ?,
+        attempts = attempts + 1, last_error = ?
+        where id = ? and status = 'sending' and lease_owner = ?"""
+UPDATE_JOB_FAILED = """update email_jobs set status = 'failed',
+        attempts = attempts + 1, last_error = ?
+        where id = ? and status = 'sending' and lease_owner = ?"""
+UPDATE_REMINDER_DELIVERY = """update advToDo set status = ?, sent_at = ?,
+        attempts = attempts + 1, last_error = ?
+        where id = ?"""
+SELECT_JOB_STATUS_COUNTS = "select status, count(*) from email_jobs group by status"
+
+
+def to_epoch(value):
+    """Приводит datetime / число / ISO-строку к epoch-секундам"""
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+    if isinstance(value, (int, float)):
+        return int(value)
+    return int(datetime.fromisoformat(str(value)).timestamp())
+
+def from_epoch(value):
+    return datetime.fromtimestamp(value)
+
+
+def create_table():
+    """Создаёт или обновляет схему базы до последней версии"""
+    migrate()
+
+def insert_deadline(name, desc, date, recurrence=None):
+    """Добавляет напоминание; recurrence - правило повтора (см. recurrence.py)"""
+    deadline = to_epoch(date)
+    with transaction() as conn:
+        if recurrence:
+            parse_rule(recurrence)  # ValueError для некорректного правила
+            cur = conn.execute(INSERT_RECURRING_DEADLINE,
+                               (name, desc, deadline, recurrence, deadline))
+        else:
+            cur = conn.execute(INSERT_DEADLINE, (name, desc, deadline))
+        return cur.lastrowid
+
+def insert_deadlines(deadlines, chunk_size=BULK_CHUNK_SIZE, on_chunk=None):
+    """Пакетная вставка напоминаний (name, description, date).
+
+    Строки вставляются через executemany пачками по chunk_size, каждая пачка -
+    одна транзакция. Итератор читается лениво, поэтому вход может быть
+    потоком любой длины. on_chunk(total) вызывается после каждой пачки.
+    Возвращает число вставленных строк.
+    """
+    rows = ((name, desc, to_epoch(date)) for name, desc, date in deadlines)
+    total = 0
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        with transaction() as conn:
+            conn.executemany(INSERT_DEADLINE, chunk)
+        total += len(chunk)
+        if on_chunk is not None:
+            on_chunk(total)
+    return total
+
+def count_reminders():
+    with connection() as conn:
+        return conn.execute(SELECT_REMINDER_COUNT).fetchone()[0]
+
+def iter_reminders_for_export(chunk_size=EXPORT_CHUNK_SIZE):
+    """Отдаёт (name, description, deadline) пачками через fetchmany, новые первыми"""
+    with connection() as conn:
+        cur = conn.execute(SELECT_REMINDERS_FOR_EXPORT)
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+
+def iter_reminders_since(last_id=0, chunk_size=EXPORT_CHUNK_SIZE):
+    """Отдаёт пачками строки с id > last_id в порядке id"""
+    with connection() as conn:
+        cur = conn.execute(SELECT_REMINDERS_SINCE, (last_id,))
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+
+def get_watermark(target):
+    with connection() as conn:
+        row = conn.execute(SELECT_WATERMARK, (target,)).fetchone()
+        return row[0] if row else None
+
+def set_watermark(target, last_id):
+    with transaction() as conn:
+        conn.execute(UPSERT_WATERMARK, (target, last_id, int(datetime.now().timestamp())))
+
+def history_page(before_id=None, limit=100):
+    """Следующая страница истории: limit напоминаний с id меньше before_id"""
+    before_id = 2 ** 63 - 1 if before_id is None else before_id
+    with connection() as conn:
+        return [tuple(row) for row in conn.execute(SELECT_HISTORY_PAGE, (before_id, limit))]
+
+def fts_query(text):
+    """Переводит ввод пользователя в запрос FTS5: все слова, поиск по префиксу"""
+    words = [word.replace('"', '""') for word in text.split()]
+    return ' '.join(f'"{word}"*' for word in words)
+
+def search_reminders(text, limit=50, offset=0):
+    """Напоминания, в названии или описании которых есть все слова из text"""
+    query = fts_query(text)
+    if not query:
+        return []
+    with connection() as conn:
+        return [tuple(row) for row in conn.execute(SELECT_SEARCH, (query, limit, offset))]
+
+def due_between(start, end, status=None):
+    """Напоминания со сроком в [start, end) - диапазонный поиск по индексу"""
+    with connection() as conn:
+        if status is None:
+            return conn.execute(SELECT_DUE_BETWEEN, (to_epoch(start), to_epoch(end))).fetchall()
+        return conn.execute(
+            SELECT_DUE_BETWEEN_STATUS, (status, to_epoch(start), to_epoch(end))
+        ).fetchall()
+
+def next_pending(limit, after=None):
+    """Ближайшие limit ожидающих напоминаний начиная с after (по умолчанию - сейчас)"""
+    after = datetime.now() if after is None else after
+    with connection() as conn:
+        return conn.execute(SELECT_NEXT_PENDING, (to_epoch(after), limit)).fetchall()
+
+def add_email_job(reminder_id, recipient, run_at, subject, body, message=None, group_id=None):
+    """Сохраняет письмо к отправке (повторное планирование перезаписывает его).
+
+    message - готовое MIME-письмо в байтах (mail_transport.render_message);
+    group_id - рассылка группе адресатов, recipient тогда - имя группы.
+    """
+    with transaction() as conn:
+        job_id = conn.execute(
+            UPSERT_EMAIL_JOB,
+            (reminder_id, recipient, to_epoch(run_at), subject, body, message, group_id)
+        ).fetchone()[0]
+        conn.execute(DELETE_JOB_DELIVERIES, (job_id,))
+        return job_id
+
+def set_group(name, emails):
+    """Создаёт группу адресатов или заменяет её состав; возвращает id группы"""
+    if '@' in name:
+        # Получатель с @ - адрес, без @ - имя группы (см. engine.schedule_reminder)
+        raise ValueError(f"Имя группы не может содержать @: {name!r}")
+    with transaction() as conn:
+        group_id = conn.execute(UPSERT_GROUP, (name,)).fetchone()[0]
+        conn.execute(DELETE_GROUP_MEMBERS, (group_id,))
+        conn.executemany(INSERT_GROUP_MEMBER, ((group_id, email) for email in emails))
+        return group_id
+
+def get_group_id(name):
+    with connection() as conn:
+        row = conn.execute(SELECT_GROUP_ID, (name,)).fetchone()
+        return row[0] if row else None
+
+def list_groups():
+    """(имя, число участников) всех групп"""
+    with connection() as conn:
+        return conn.execute(SELECT_GROUPS).fetchall()
+
+def group_members(name):
+    with connection() as conn:
+        return [row[0] for row in conn.execute(SELECT_GROUP_MEMBERS, (name,))]
+
+def expand_group_job(job):
+    """Адресаты рассылки, которым письмо ещё не отправлено"""
+    with transaction() as conn:
+        conn.execute(EXPAND_GROUP_JOB, (job['id'], job['group_id']))
+        return [row[0] for row in conn.execute(SELECT_PENDING_DELIVERIES, (job['id'],))]
+
+def mark_deliveries(job_id, sent=(), retry=(), failed=()):
+    """Итог отправки пачки рассылки: retry и failed - пары (адресат, ошибка)"""
+    sent_at = int(datetime.now().timestamp())
+    with transaction() as conn:
+        conn.executemany(UPDATE_DELIVERY_SENT,
+                         ((sent_at, job_id, recipient) for recipient in sent))
+        conn.executemany(UPDATE_DELIVERY_RETRY,
+                         ((error, job_id, recipient) for recipient, error in retry))
+        conn.executemany(UPDATE_DELIVERY_FAILED,
+                         ((error, job_id, recipient) for recipient, error in failed))
+
+def fail_pending_deliveries(job_id, error):
+    with transaction() as conn:
+        return conn.execute(FAIL_PENDING_DELIVERIES, (error, job_id)).rowcount
+
+def delivery_counts(job_id):
+    """Число адресатов рассылки по статусам"""
+    with connection() as conn:
+        return dict(conn.execute(SELECT_DELIVERY_COUNTS, (job_id,)).fetchall())
+
+def job_deliveries(job_id):
+    """Статус доставки каждому адресату рассылки"""
+    with connection() as conn:
+        return conn.execute(SELECT_DELIVERIES, (job_id,)).fetchall()
+
+def last_group_job(name):
+    """id последнего письма, запланированного группе"""
+    with connection() as conn:
+        row = conn.execute(SELECT_LAST_GROUP_JOB, (name,)).fetchone()
+        return row[0] if row else None
+
+def get_email_job(job_id):
+    with connection() as conn:
+        return conn.execute(SELECT_EMAIL_JOB, (job_id,)).fetchone()
+
+def jobs_due_between(start, end):
+    """(id, run_at) ожидающих писем со временем отправки в (start, end]"""
+    with connection() as conn:
+        return conn.execute(SELECT_JOBS_DUE_BETWEEN, (to_epoch(start), to_epoch(end))).fetchall()
+
+def next_run_at():
+    """Время ближайшего ожидающего письма (по индексу status, run_at)"""
+    with connection() as conn:
+        return conn.execute(SELECT_NEXT_RUN_AT).fetchone()[0]
+
+def enqueue_job(job_id, now=None):
+    """Переводит письмо в очередь отправки, если его время наступило"""
+    now = int(datetime.now().timestamp()) if now is None else to_epoch(now)
+    with transaction() as conn:
+        return conn.execute(ENQUEUE_JOB, (now, job_id, now + 1)).rowcount
+
+def enqueue_overdue_jobs(until):
+    """Одним запросом ставит в очередь все просроченные ожидающие письма"""
+    until = to_epoch(until)
+    with transaction() as conn:
+        return conn.execute(ENQUEUE_OVERDUE_JOBS, (until, until)).rowcount
+
+def claim_ready_jobs(now, limit, owner, lease_until):
+    """Арендует для owner до limit готовых писем (и писем с истёкшей арендой)"""
+    now = to_epoch(now)
+    with transaction() as conn:
+        return conn.execute(
+            CLAIM_READY_JOBS, (owner, to_epoch(lease_until), now, limit, now, limit, limit)
+        ).fetchall()
+
+def claim_digest_jobs(recipient, now, until, limit, owner, lease_until):
+    """Арендует письма адресату, готовые к now или запланированные не позже until"""
+    with transaction() as conn:
+        return conn.execute(
+            CLAIM_DIGEST_JOBS,
+            (owner, to_epoch(lease_until), recipient, to_epoch(now), limit,
+             recipient, to_epoch(until), limit, limit)
+        ).fetchall()
+
+def get_recurrence(reminder_id):
+    """(name, recurrence, dtstart) напоминания"""
+    with connection() as conn:
+        return conn.execute(SELECT_RECURRENCE, (reminder_id,)).fetchone()
+
+def move_reminder_deadline(reminder_id, deadline):
+    """Переносит срок повторяющегося напоминания на следующее наступление"""
+    deadline = to_epoch(deadline)
+    with transaction() as conn:
+        conn.execute(UPDATE_REMINDER_DEADLINE, (deadline, reminder_id, deadline))
+
+def finished_recurring_jobs():
+    """Завершённые письма повторяющихся напоминаний (для перепланирования)"""
+    with connection() as conn:
+        return conn.execute(SELECT_FINISHED_RECURRING_JOBS).fetchall()
+
+def next_attempt_at():
+    with connection() as conn:
+        return conn.execute(SELECT_NEXT_ATTEMPT).fetchone()[0]
+
+def renew_leases(owner, lease_until, job_ids):
+    """Продлевает аренду писем job_ids, которые сейчас отправляет owner"""
+    lease_until = to_epoch(lease_until)
+    with transaction() as conn:
+        return conn.executemany(
+            RENEW_LEASES, ((lease_until, job_id, owner) for job_id in job_ids)
+        ).rowcount
+
+def release_leases(owner):
+    """Возвращает в очередь арендованные owner письма, отправка которых не началась"""
+    with transaction() as conn:
+        return conn.execute(RELEASE_LEASES, (owner,)).rowcount
+
+def mark_job_sent(job):
+    """False, если аренду письма уже перехватил другой экземпляр"""
+    sent_at = int(datetime.now().timestamp())
+    with transaction() as conn:
+        if not conn.execute(UPDATE_JOB_SENT, (sent_at, job['id'], job['lease_owner'])).rowcount:
+            return False
+        conn.execute(UPDATE_REMINDER_DELIVERY, (STATUS_SENT, sent_at, None, job['reminder_id']))
+        return True
+
+def mark_jobs_sent(jobs):
+    """Отмечает отправленными письма, ушедшие одним дайджестом; возвращает отмеченные"""
+    with transaction():
+        return [job for job in jobs if mark_job_sent(job)]
+
+def mark_job_retry(job, next_attempt, error):
+    with transaction() as conn:
+        conn.execute(UPDATE_JOB_RETRY,
+                     (to_epoch(next_attempt), error, job['id'], job['lease_owner']))
+
+def mark_job_failed(job, error):
+    with transaction() as conn:
+        if conn.execute(UPDATE_JOB_FAILED, (error, job['id'], job['lease_owner'])).rowcount:
+            conn.execute(UPDATE_REMINDER_DELIVERY,
+                         (STATUS_FAILED, None, error, job['reminder_id']))
+
+def job_status_counts():
+    """Число писем в email_jobs по статусам"""
+    with connection() as conn:
+        return dict(conn.execute(SELECT_JOB_STATUS_COUNTS).fetchall())
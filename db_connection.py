@@ -0,0 +1,167 @@
+"""Общий менеджер соединений с SQLite.
+
+Все обращения к базе идут через этот модуль. Соединения долгоживущие:
+поток берёт соединение из пула, а после работы возвращает его обратно,
+не закрывая. Каждое соединение открывается один раз с WAL-журналом,
+настроенными PRAGMA и кэшем подготовленных выражений.
+"""
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+DB_PATH = os.getenv('ADVTODO_DB', 'database.db')
+
+# PRAGMA, которые выполняются для каждого нового соединения
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",      # читатели не блокируют писателя
+    "PRAGMA synchronous=NORMAL",    # в режиме WAL fsync только на checkpoint
+    "PRAGMA cache_size=-16000",     # ~16 МБ страничного кэша
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA foreign_keys=ON",
+)
+
+# Размер кэша подготовленных выражений sqlite3 (ключ - текст запроса),
+# поэтому запросы в database.py объявлены константами
+STATEMENT_CACHE_SIZE = 256
+BUSY_TIMEOUT = 30.0
+MAX_CONNECTIONS = 8
+
+
+class ConnectionPool:
+    """Пул долгоживущих соединений с учётом потоков.
+
+    Внутри одного потока вложенные вызовы connection() получают одно и то
+    же соединение, поэтому функции из database.py можно вызывать внутри
+    общей транзакции.
+    """
+
+    def __init__(self, path=DB_PATH, max_connections=MAX_CONNECTIONS):
+        self.path = path
+        self.max_connections = max_connections
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._idle = []
+        self._closed = False
+
+    def _open(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=BUSY_TIMEOUT,
+            isolation_level=None,  # транзакциями управляет transaction()
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        conn.row_factory = sqlite3.Row
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _acquire(self):
+        self._slots.acquire()
+        try:
+            with self._lock:
+                if self._closed:
+                    raise sqlite3.ProgrammingError("Пул соединений закрыт")
+                if self._idle:
+                    return self._idle.pop()
+            return self._open()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _release(self, conn):
+        if conn.in_transaction:
+            # Незавершённая транзакция не должна попасть к другому потоку
+            conn.rollback()
+        with self._lock:
+            if self._closed:
+                conn.close()
+            else:
+                self._idle.append(conn)
+        self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Выдаёт соединение текущего потока (повторно входимо)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.depth += 1
+            try:
+                yield conn
+            finally:
+                self._local.depth -= 1
+            return
+
+        conn = self._acquire()
+        self._local.conn = conn
+        self._local.depth = 1
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            self._local.depth = 0
+            self._release(conn)
+
+    @contextmanager
+    def transaction(self):
+        """Открывает транзакцию на запись; вложенные вызовы входят во внешнюю"""
+        with self.connection() as conn:
+            if conn.in_transaction:
+                yield conn
+                return
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            else:
+                conn.commit()
+
+    def close_all(self):
+        """Закрывает все соединения (вызывается при выходе из приложения)"""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Возвращает общий пул, создавая его при первом обращении"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool()
+    return _pool
+
+
+def configure(path, max_connections=MAX_CONNECTIONS):
+    """Переключает общий пул на другой файл базы (для тестов и бенчмарков)"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close_all()
+        _pool = ConnectionPool(path, max_connections)
+    return _pool
+
+
+def connection():
+    return get_pool().connection()
+
+
+def transaction():
+    return get_pool().transaction()
+
+
+def close_all():
+    if _pool is not None:
+        _pool.close_all()
@@ -0,0 +1,136 @@
+"""Фоновая запись в базу с групповым коммитом.
+
+Окно не пишет в базу само: запись (вызов функции из database.py) ставится
+в очередь, а один поток-писатель выполняет её и сообщает результат через
+concurrent.futures.Future. Записи, пришедшие почти одновременно (в пределах
+GROUP_WINDOW), выполняются в одной транзакции и делят один коммит. Каждая
+запись идёт в своей точке сохранения (SAVEPOINT), поэтому ошибка одной
+откатывает только её, а остальные записи группы сохраняются.
+
+Future завершается после коммита, то есть результат уже лежит на диске.
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from db_connection import transaction
+
+
+GROUP_WINDOW = 0.005     # сколько ждать следующих записей в группу, сек
+MAX_GROUP_SIZE = 256
+
+_STOP = object()
+
+
+class DatabaseWriter:
+    def __init__(self, group_window=GROUP_WINDOW, max_group_size=MAX_GROUP_SIZE):
+        self.group_window = group_window
+        self.max_group_size = max_group_size
+        self.commits = 0
+        self.writes = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+                self._thread.start()
+
+    def submit(self, fn, *args, **kwargs):
+        """Ставит fn(*args, **kwargs) в очередь записи и возвращает Future"""
+        self.start()
+        future = Future()
+        self._queue.put((future, fn, args, kwargs))
+        return future
+
+    def flush(self, timeout=None):
+        """Ждёт, пока будут закоммичены все записи, поставленные до вызова"""
+        return self.submit(lambda: None).result(timeout)
+
+    def stop(self, timeout=10):
+        """Дописывает очередь и останавливает поток"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            group = [self._queue.get()]
+            deadline = time.monotonic() + self.group_window
+            while len(group) < self.max_group_size:
+                try:
+                    group.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            if _STOP in group:
+                stopping = True
+                group = [item for item in group if item is not _STOP]
+                # Остаток очереди тоже дописываем перед остановкой
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not _STOP:
+                        group.append(item)
+            if group:
+                self._commit(group)
+
+    def _commit(self, group):
+        results = []
+        try:
+            with transaction() as conn:
+                for future, fn, args, kwargs in group:
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    conn.execute("SAVEPOINT write_op")
+                    try:
+                        result = fn(*args, **kwargs)
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO write_op")
+                        conn.execute("RELEASE write_op")
+                        future.set_exception(e)
+                    else:
+                        conn.execute("RELEASE write_op")
+                        results.append((future, result))
+        except Exception as e:
+            logging.exception("Не удалось закоммитить группу записей")
+            for future, *_ in group:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.commits += 1
+        self.writes += len(results)
+        for future, result in results:
+            future.set_result(result)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """Возвращает общий поток-писатель, создавая его при первом обращении"""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = DatabaseWriter()
+    return _writer
+
+
+def submit(fn, *args, **kwargs):
+    return get_writer().submit(fn, *args, **kwargs)
+
+
+def stop(timeout=10):
+    if _writer is not None:
+        _writer.stop(timeout)
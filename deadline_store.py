@@ -0,0 +1,88 @@
+"""Компактное хранилище дедлайнов текущей сессии.
+
+Записи с __slots__ лежат в min-куче по времени срабатывания: добавление
+за O(log n), ближайший дедлайн за O(1). Отправленные и давно прошедшие
+записи вытесняются, поэтому память не растёт при долгой работе.
+"""
+import heapq
+import itertools
+import threading
+import time
+
+from database import to_epoch
+
+
+# Сколько секунд хранить прошедший дедлайн (как misfire_grace_time планировщика)
+EXPIRY_GRACE = 300
+
+
+class Deadline:
+    __slots__ = ('id', 'datetime', 'description', 'details', 'notified', 'due')
+
+    def __init__(self, id, datetime, description, details=''):
+        self.id = id
+        self.datetime = datetime
+        self.description = description
+        self.details = details
+        self.notified = False
+        self.due = to_epoch(datetime)
+
+
+class DeadlineStore:
+    def __init__(self, expiry_grace=EXPIRY_GRACE):
+        self.expiry_grace = expiry_grace
+        self._heap = []          # (due, seq, Deadline)
+        self._by_id = {}
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        # Последний добавленный и ещё не отправленный/не вытесненный дедлайн -
+        # к нему относится кнопка отправки в окне
+        self.last_added = None
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def add(self, deadline):
+        with self._lock:
+            self._evict()
+            heapq.heappush(self._heap, (deadline.due, next(self._seq), deadline))
+            self._by_id[deadline.id] = deadline
+            self.last_added = deadline
+
+    def get(self, reminder_id):
+        with self._lock:
+            return self._by_id.get(reminder_id)
+
+    def next_due(self):
+        """Ближайший неотправленный дедлайн или None"""
+        with self._lock:
+            self._evict()
+            return self._heap[0][2] if self._heap else None
+
+    def mark_notified(self, reminder_id):
+        """Отмечает напоминание отправленным и убирает его из хранилища"""
+        with self._lock:
+            deadline = self._by_id.pop(reminder_id, None)
+            if deadline is None:
+                return
+            deadline.notified = True
+            if self.last_added is deadline:
+                self.last_added = None
+            # Из кучи запись удаляется лениво; если таких много - перестраиваем
+            if len(self._heap) > 2 * len(self._by_id) + 64:
+                self._heap = [item for item in self._heap if not item[2].notified]
+                heapq.heapify(self._heap)
+            self._evict()
+
+    def _evict(self):
+        """Снимает с вершины кучи отправленные и давно прошедшие дедлайны"""
+        expired_before = time.time() - self.expiry_grace
+        while self._heap:
+            due, _, deadline = self._heap[0]
+            if not deadline.notified and due >= expired_before:
+                break
+            heapq.heappop(self._heap)
+            if self._by_id.get(deadline.id) is deadline:
+                del self._by_id[deadline.id]
+            if self.last_added is deadline:
+                self.last_added = None
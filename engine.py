@@ -0,0 +1,261 @@
+"""Ядро напоминаний: планирование и доставка писем без графического интерфейса.
+
+ReminderEngine собирает вместе планировщик, хранилище запланированных
+писем (jobstore) и диспетчер очереди отправки (outbox). Движок не зависит
+от Qt: о результатах доставки он сообщает обычными функциями-слушателями,
+поэтому его может запускать как окно приложения, так и фоновый процесс
+(python -m advtodo daemon).
+
+После отправки письма повторяющегося напоминания движок перепланирует
+то же письмо на следующее наступление (recurrence.py).
+
+Режим планирования (ADVTODO_SCHEDULER):
+    jobs  - задача APScheduler на каждое письмо ближайшего окна (jobstore.py)
+    timer - один таймер до ближайшего письма без задач на письма
+            (timer_scheduler.py), для сотен тысяч ожидающих писем
+"""
+import logging
+import os
+import re
+import threading
+from datetime import datetime
+
+from apscheduler.events import EVENT_JOB_MISSED
+from apscheduler.schedulers.background import BackgroundScheduler
+
+import database
+import mail_transport
+import metrics
+import recurrence
+from database import from_epoch
+from jobstore import ReminderJobStore
+from outbox import DIGEST_WINDOW, OutboxDispatcher
+from timer_scheduler import TimerScheduler
+
+
+TIMEZONE = os.getenv('ADVTODO_TIMEZONE', 'Europe/Moscow')
+SCHEDULER_MODES = ('jobs', 'timer')
+SCHEDULER_MODE = os.getenv('ADVTODO_SCHEDULER', 'jobs')
+
+
+def build_reminder_email(description, deadline_time):
+    """Тема и HTML-текст письма-напоминания"""
+    subject = "Напоминание: " + description
+    body = f"""
+        <h2>Напоминание</h2>
+        <p><strong>Дата и время:</strong> {deadline_time.strftime('%d.%m.%Y %H:%M')}</p>
+        <p><strong>Описание:</strong> {description}</p>
+        """
+    return subject, body
+
+
+def _group_id(recipient):
+    """id группы, если recipient - имя группы (без @), иначе None"""
+    if '@' in recipient:
+        return None
+    group_id = database.get_group_id(recipient)
+    if group_id is None:
+        raise ValueError(f"Нет группы адресатов {recipient!r}")
+    return group_id
+
+
+def _render_message(recipient, subject, body, group_id=None):
+    to = mail_transport.UNDISCLOSED_RECIPIENTS if group_id is not None else recipient
+    return mail_transport.render_message(mail_transport.get_transport().sender, to, subject, body)
+
+
+class ReminderEngine:
+    def __init__(self, timezone=TIMEZONE, daemon=True, mode=SCHEDULER_MODE,
+                 digest_window=DIGEST_WINDOW, metrics_port=metrics.METRICS_PORT,
+                 metrics_file=metrics.METRICS_FILE):
+        if mode not in SCHEDULER_MODES:
+            raise ValueError(f"Неизвестный режим планирования: {mode}")
+        self.timezone = timezone
+        self.daemon = daemon
+        self.mode = mode
+        self.digest_window = digest_window
+        self.metrics_port = metrics_port
+        self.metrics_file = metrics_file
+        self._metrics_server = None
+        self.scheduler = None
+        self.outbox = None
+        self.jobstore = None
+        self._sent_listeners = []
+        self._failed_listeners = []
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self.scheduler is not None
+
+    def add_listener(self, on_sent=None, on_failed=None):
+        """Подписывает на события доставки: on_sent(job), on_failed(job, error).
+
+        Слушатели вызываются из потока диспетчера очереди.
+        """
+        if on_sent is not None:
+            self._sent_listeners.append(on_sent)
+        if on_failed is not None:
+            self._failed_listeners.append(on_failed)
+
+    def _notify_sent(self, job):
+        self._schedule_next_occurrence(job)
+        for listener in self._sent_listeners:
+            try:
+                listener(job)
+            except Exception:
+                logging.exception("Ошибка в обработчике отправленного письма")
+
+    def _notify_failed(self, job, error):
+        self._schedule_next_occurrence(job)
+        for listener in self._failed_listeners:
+            try:
+                listener(job, error)
+            except Exception:
+                logging.exception("Ошибка в обработчике неотправленного письма")
+
+    def start(self):
+        """Поднимает базу, планировщик и очередь писем (повторный вызов ничего не делает)"""
+        with self._lock:
+            if self.scheduler is not None:
+                return
+            database.create_table()
+
+            self.scheduler = BackgroundScheduler(
+                timezone=self.timezone,
+                daemon=self.daemon,
+                job_defaults={
+                    'misfire_grace_time': 300,
+                    'coalesce': True,
+                    'max_instances': 3
+                }
+            )
+            self.scheduler.add_listener(self._on_job_missed, EVENT_JOB_MISSED)
+            self.scheduler.start()
+
+            # Письма отправляет асинхронный диспетчер очереди с повторами
+            self.outbox = OutboxDispatcher(
+                digest_window=self.digest_window,
+                on_sent=self._notify_sent,
+                on_failed=self._notify_failed
+            )
+            self.outbox.start()
+
+            # Письма хранятся в базе и восстанавливаются после перезапуска
+            if self.mode == 'timer':
+                self.jobstore = TimerScheduler(self.outbox)
+            else:
+                self.jobstore = ReminderJobStore(self.scheduler, self.outbox)
+            self.jobstore.rehydrate()
+            # Повторы, которые не успели перепланировать до остановки
+            for job in database.finished_recurring_jobs():
+                self._schedule_next_occurrence(job)
+
+            # SMTP-сессии берутся из общего пула; простаивающие проверяем NOOP
+            self.scheduler.add_job(
+                mail_transport.keepalive, 'interval',
+                seconds=mail_transport.KEEPALIVE_INTERVAL, id='smtp_keepalive'
+            )
+            if self.metrics_port:
+                self._metrics_server = metrics.serve(self.metrics_port)
+            if self.metrics_file:
+                self.scheduler.add_job(
+                    metrics.write_file, 'interval', args=[self.metrics_file],
+                    seconds=metrics.FILE_INTERVAL, id='metrics_file'
+                )
+            logging.info(f"Движок напоминаний запущен (режим {self.mode})")
+
+    def stop(self, timeout=10):
+        """Останавливает планировщик, дожидается очереди писем и закрывает SMTP-сессии"""
+        with self._lock:
+            if self.scheduler is None:
+                return
+            self.scheduler.shutdown()
+            if self.mode == 'timer':
+                self.jobstore.stop(timeout)
+            self.outbox.stop(timeout)
+            mail_transport.close()
+            if self._metrics_server is not None:
+                self._metrics_server.shutdown()
+                self._metrics_server = None
+            if self.metrics_file:
+                metrics.write_file(self.metrics_file)
+            self.scheduler = None
+            self.outbox = None
+            self.jobstore = None
+            logging.info("Движок напоминаний остановлен")
+
+    def _schedule_next_occurrence(self, job):
+        """Перепланирует письмо повторяющегося напоминания на следующее наступление"""
+        try:
+            reminder = database.get_recurrence(job['reminder_id'])
+            if reminder is None or not reminder['recurrence']:
+                return
+            rule = recurrence.parse_rule(reminder['recurrence'])
+            after = max(from_epoch(job['run_at']), datetime.now())
+            next_at = recurrence.next_occurrence(rule, from_epoch(reminder['dtstart']), after)
+            if next_at is None:
+                logging.info(f"Повторы напоминания {job['reminder_id']} закончились")
+                return
+            database.move_reminder_deadline(job['reminder_id'], next_at)
+            subject, body = build_reminder_email(reminder['name'], next_at)
+            # Вызывается и из start() под self._lock - поэтому не через schedule()
+            self._add(job['reminder_id'], job['recipient'], next_at, subject, body,
+                      job['group_id'])
+        except Exception:
+            logging.exception(f"Не удалось перепланировать повтор письма {job['id']}")
+
+    def _on_job_missed(self, event):
+        """Задача опоздала больше чем на misfire_grace_time и не была запущена"""
+        logging.warning(f"Пропущен запуск задачи {event.job_id}")
+        # email_catch_up, email_refill, smtp_keepalive и metrics_file - служебные
+        # задачи, а не письма: в метрику пропусков они не попадают
+        match = re.fullmatch(r'email_(\d+)', event.job_id)
+        if match is None:
+            return
+        metrics.misfires.inc()
+        if self.outbox is not None:
+            # Письмо лучше отправить с опозданием, чем оставить до перезапуска
+            self.outbox.enqueue(int(match.group(1)))
+
+    def schedule(self, reminder_id, recipient, run_at, subject, body, group_id=None):
+        """Сохраняет письмо в базе и планирует его отправку; возвращает id задачи.
+
+        MIME-письмо собирается и кодируется сразу, чтобы в момент срабатывания
+        оставалась только передача по сети. С group_id письмо - рассылка
+        группе recipient, оно уходит каждому участнику группы.
+        """
+        self.start()
+        return self._add(reminder_id, recipient, run_at, subject, body, group_id)
+
+    def _add(self, reminder_id, recipient, run_at, subject, body, group_id=None):
+        message = _render_message(recipient, subject, body, group_id)
+        return self.jobstore.add(reminder_id, recipient, run_at, subject, body, message, group_id)
+
+    def schedule_reminder(self, reminder_id, recipient, deadline_time, description):
+        """Планирует стандартное письмо-напоминание о дедлайне.
+
+        recipient - адрес или имя группы адресатов (см. database.set_group).
+        """
+        group_id = _group_id(recipient)
+        subject, body = build_reminder_email(description, deadline_time)
+        return self.schedule(reminder_id, recipient, deadline_time, subject, body, group_id)
+
+    def store_reminder(self, reminder_id, recipient, deadline_time, description):
+        """Только сохраняет письмо-напоминание в базе; возвращает id письма.
+
+        Для записи в чужой транзакции (db_writer.py): планировщику письмо
+        передаётся через register() уже после коммита, чтобы в нём не
+        осталось задачи для откаченной строки.
+        """
+        group_id = _group_id(recipient)
+        subject, body = build_reminder_email(description, deadline_time)
+        message = _render_message(recipient, subject, body, group_id)
+        return database.add_email_job(
+            reminder_id, recipient, deadline_time, subject, body, message, group_id
+        )
+
+    def register(self, job_id, run_at):
+        """Передаёт планировщику письмо, уже сохранённое в базе"""
+        self.start()
+        self.jobstore.register(job_id, run_at)
@@ -0,0 +1,115 @@
+"""Потоковый экспорт напоминаний в CSV / JSONL.
+
+Строки пишутся в файл прямо из курсора пачками, поэтому память не зависит
+от размера истории. Поля записи совпадают с форматом importer.py: id, name,
+description, deadline (ISO-дата), status, recurrence.
+
+Инкрементальный режим (--incremental) дописывает в конец файла только
+напоминания, добавленные после прошлой выгрузки в этот файл: отметка
+(последний выгруженный id) хранится в таблице export_watermarks, а выборка
+идёт по диапазону первичного ключа, так что регулярная синхронизация
+стоит O(новых строк). Отметка сдвигается после того, как строки записаны
+на диск; при сбое между этими шагами строки будут выгружены повторно.
+
+Использование:
+    python exporter.py reminders.csv
+    python exporter.py reminders.jsonl --incremental
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import time
+
+from database import (
+    EXPORT_CHUNK_SIZE, create_table, from_epoch, get_watermark, iter_reminders_since,
+    set_watermark,
+)
+
+
+FIELDS = ('id', 'name', 'description', 'deadline', 'status', 'recurrence')
+
+
+def _to_record(row):
+    record = dict(zip(FIELDS, row))
+    record['deadline'] = from_epoch(record['deadline']).isoformat()
+    return record
+
+
+def write_csv(f, chunks, header):
+    writer = csv.writer(f)
+    if header:
+        writer.writerow(FIELDS)
+    for rows in chunks:
+        for row in rows:
+            record = _to_record(row)
+            writer.writerow([record[field] for field in FIELDS])
+            yield row['id']
+
+
+def write_jsonl(f, chunks, header):
+    for rows in chunks:
+        for row in rows:
+            f.write(json.dumps(_to_record(row), ensure_ascii=False))
+            f.write('\n')
+            yield row['id']
+
+
+WRITERS = {
+    '.csv': write_csv,
+    '.jsonl': write_jsonl,
+    '.ndjson': write_jsonl,
+}
+
+
+def export_file(path, incremental=False, chunk_size=EXPORT_CHUNK_SIZE):
+    """Выгружает напоминания в файл и возвращает (число строк, строк в секунду)"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in WRITERS:
+        raise ValueError(f"Неподдерживаемый формат файла: {ext}")
+
+    create_table()
+    target = os.path.abspath(path)
+    exists = os.path.exists(target) and os.path.getsize(target) > 0
+    last_id = (get_watermark(target) or 0) if incremental and exists else 0
+    # Полная выгрузка пишется во временный файл и подменяет старый целиком
+    out_path = target if incremental else f"{target}.tmp"
+
+    started = time.perf_counter()
+    total = 0
+    chunks = iter_reminders_since(last_id, chunk_size)
+    try:
+        with open(out_path, 'a' if incremental else 'w', newline='', encoding='utf-8') as f:
+            for row_id in WRITERS[ext](f, chunks, header=not (incremental and exists)):
+                last_id = row_id
+                total += 1
+                if total % (chunk_size * 20) == 0:
+                    logging.info(f"Выгружено {total} строк")
+            f.flush()
+            os.fsync(f.fileno())
+    finally:
+        chunks.close()
+    if not incremental:
+        os.replace(out_path, target)
+    set_watermark(target, last_id)
+
+    elapsed = time.perf_counter() - started
+    return total, (total / elapsed if elapsed else 0.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Экспорт напоминаний в CSV / JSONL")
+    parser.add_argument('path', help="файл .csv или .jsonl")
+    parser.add_argument('--incremental', action='store_true',
+                        help="дописать только напоминания, добавленные после прошлой выгрузки")
+    parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    total, rate = export_file(args.path, args.incremental, args.chunk_size)
+    print(f"Выгружено {total} строк, {rate:.0f} строк/с")
+
+
+if __name__ == "__main__":
+    main()
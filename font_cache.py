@@ -0,0 +1,161 @@
+"""Кэш шрифтов DejaVu для генерации PDF.
+
+fpdf при каждом add_font читает метрики шрифта, а при каждом output()
+заново разбирает TTF-файл, строит подмножество глифов и таблицу ширин
+(перебирая все ~65 тыс. символов шрифта). Здесь метрики загружаются один
+раз за процесс (и хранятся на диске в .font_cache под ключом - хешем
+содержимого шрифта), а подмножества глифов и таблицы ширин
+переиспользуются между экспортами с тем же набором символов.
+"""
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+import fpdf.fpdf
+from fpdf.ttfonts import TTFontFile
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FONT_CACHE_DIR = os.path.join(BASE_DIR, '.font_cache')
+
+# (семейство, стиль, файл шрифта)
+FONTS = (
+    ('DejaVu', '', os.path.join(BASE_DIR, 'DejaVuSans.ttf')),
+    ('DejaVu', 'B', os.path.join(BASE_DIR, 'DejaVuSans-Bold.ttf')),
+)
+
+SUBSET_CACHE_SIZE = 16
+
+_lock = threading.Lock()
+_hashes = {}
+_metrics = {}
+_subsets = OrderedDict()
+_widths = OrderedDict()
+
+
+def font_hash(path):
+    """SHA-1 содержимого шрифта (считается один раз на файл)"""
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    if key not in _hashes:
+        with open(path, 'rb') as f:
+            _hashes[key] = hashlib.sha1(f.read()).hexdigest()
+    return _hashes[key]
+
+
+def _parse_metrics(family, style, path):
+    """Разбирает шрифт средствами fpdf, не трогая его собственный кэш .pkl"""
+    cache_mode = fpdf.fpdf.FPDF_CACHE_MODE
+    fpdf.set_global('FPDF_CACHE_MODE', 1)
+    try:
+        pdf = fpdf.FPDF()
+        pdf.add_font(family, style, path, uni=True)
+    finally:
+        fpdf.set_global('FPDF_CACHE_MODE', cache_mode)
+    fontkey = family.lower() + style
+    return {'font': pdf.fonts[fontkey], 'file': pdf.font_files[fontkey]}
+
+
+def _load_metrics(family, style, path):
+    digest = font_hash(path)
+    key = (family.lower() + style, digest)
+    with _lock:
+        if key in _metrics:
+            return _metrics[key]
+        cache_file = os.path.join(FONT_CACHE_DIR, f"{digest}.pkl")
+        try:
+            with open(cache_file, 'rb') as f:
+                metrics = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            metrics = _parse_metrics(family, style, path)
+            try:
+                os.makedirs(FONT_CACHE_DIR, exist_ok=True)
+                with open(cache_file, 'wb') as f:
+                    pickle.dump(metrics, f, pickle.HIGHEST_PROTOCOL)
+            except OSError:
+                pass  # Кэш на диске необязателен
+        _metrics[key] = metrics
+        return metrics
+
+
+def add_fonts(pdf, fonts=FONTS):
+    """Регистрирует шрифты в документе из кэша вместо pdf.add_font"""
+    if not hasattr(pdf, 'font_files'):
+        # Незнакомая версия fpdf - регистрируем обычным способом
+        for family, style, path in fonts:
+            pdf.add_font(family, style, path, uni=True)
+        return
+
+    for family, style, path in fonts:
+        fontkey = family.lower() + style
+        if fontkey in pdf.fonts:
+            continue
+        metrics = _load_metrics(family, style, path)
+        font = dict(metrics['font'])
+        font['i'] = len(pdf.fonts) + 1
+        # Набор использованных символов у каждого документа свой
+        font['subset'] = list(range(0, 57 if hasattr(pdf, 'str_alias_nb_pages') else 32))
+        font['unifilename'] = None
+        font['ttffile'] = path
+        pdf.fonts[fontkey] = font
+        pdf.font_files[fontkey] = dict(metrics['file'], ttffile=path)
+        pdf.font_files[path] = {'type': 'TTF'}
+
+
+def _cache_get(cache, key):
+    with _lock:
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+        return value
+
+
+def _cache_put(cache, key, value):
+    with _lock:
+        cache[key] = value
+        while len(cache) > SUBSET_CACHE_SIZE:
+            cache.popitem(last=False)
+
+
+class FontCacheMixin:
+    """Примесь к FPDF: шрифты из кэша и кэшированная таблица ширин /W"""
+
+    def add_cached_fonts(self, fonts=FONTS):
+        add_fonts(self, fonts)
+
+    def _putTTfontwidths(self, font, maxUni):
+        key = (font_hash(font['ttffile']), tuple(sorted(font['subset'])), maxUni)
+        widths = _cache_get(_widths, key)
+        if widths is None:
+            # fpdf проверяет "cid in subset" для каждого символа шрифта -
+            # со списком это квадратичная сложность, с множеством линейная
+            lines = []
+            out, self._out = self._out, lines.append
+            try:
+                super()._putTTfontwidths(dict(font, subset=set(font['subset'])), maxUni)
+            finally:
+                self._out = out
+            widths = lines[0]
+            _cache_put(_widths, key, widths)
+        self._out(widths)
+
+
+class CachedTTFontFile(TTFontFile):
+    """TTFontFile, который переиспользует уже построенные подмножества глифов"""
+
+    def makeSubset(self, file, subset):
+        key = (font_hash(file), tuple(subset))
+        cached = _cache_get(_subsets, key)
+        if cached is None:
+            stream = super().makeSubset(file, subset)
+            cached = (stream, self.codeToGlyph, self.maxUni)
+            _cache_put(_subsets, key, cached)
+        stream, self.codeToGlyph, self.maxUni = cached
+        return stream
+
+
+def install():
+    """Подменяет TTFontFile в fpdf на кэширующий вариант (один раз за процесс)"""
+    fpdf.fpdf.TTFontFile = CachedTTFontFile
@@ -0,0 +1,93 @@
+"""Модели истории напоминаний и результатов поиска для QListView.
+
+Строки подгружаются из базы страницами через canFetchMore/fetchMore по
+мере прокрутки, поэтому в памяти только то, что пользователь уже увидел.
+Новые напоминания добавляются в начало списка за O(1), без перестроения
+всего текста истории.
+"""
+from PyQt5 import QtCore
+
+from database import from_epoch, history_page, search_reminders
+
+
+PAGE_SIZE = 100
+
+
+class ReminderHistoryModel(QtCore.QAbstractListModel):
+    def __init__(self, parent=None, page_size=PAGE_SIZE):
+        super().__init__(parent)
+        self.page_size = page_size
+        # Добавленные в этой сессии (в порядке добавления) и загруженные из базы
+        # (от новых к старым); строка: (id, name, description, deadline)
+        self._added = []
+        self._loaded = []
+        self._oldest_id = None
+        self._exhausted = False
+
+    def _row(self, i):
+        added = len(self._added)
+        if i < added:
+            return self._added[added - 1 - i]
+        return self._loaded[i - added]
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._added) + len(self._loaded)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        reminder_id, name, description, deadline = self._row(index.row())
+        if role == QtCore.Qt.DisplayRole:
+            text = f"{from_epoch(deadline).strftime('%d.%m.%Y %H:%M')} - {name}"
+            return f"{text} — {description}" if description else text
+        if role == QtCore.Qt.ToolTipRole:
+            return description or name
+        if role == QtCore.Qt.UserRole:
+            return reminder_id
+        return None
+
+    def canFetchMore(self, parent=QtCore.QModelIndex()):
+        return not parent.isValid() and not self._exhausted
+
+    def _fetch_page(self):
+        return history_page(self._oldest_id, self.page_size)
+
+    def fetchMore(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return
+        page = self._fetch_page()
+        if len(page) < self.page_size:
+            self._exhausted = True
+        if not page:
+            return
+        first = self.rowCount()
+        self.beginInsertRows(QtCore.QModelIndex(), first, first + len(page) - 1)
+        self._loaded.extend(page)
+        self._oldest_id = page[-1][0]
+        self.endInsertRows()
+
+    def prepend(self, reminder_id, name, description, deadline):
+        """Добавляет только что созданное напоминание в начало списка"""
+        if self._oldest_id is None and not self._exhausted:
+            # Первая страница ещё не загружалась - строка придёт вместе с ней
+            return
+        self.beginInsertRows(QtCore.QModelIndex(), 0, 0)
+        self._added.append((reminder_id, name, description, deadline))
+        self.endInsertRows()
+
+
+class SearchResultsModel(ReminderHistoryModel):
+    """Результаты полнотекстового поиска, от самых релевантных"""
+
+    def __init__(self, text, parent=None, page_size=PAGE_SIZE):
+        super().__init__(parent, page_size)
+        self.text = text
+
+    def _fetch_page(self):
+        return search_reminders(self.text, self.page_size, len(self._loaded))
+
+    def prepend(self, reminder_id, name, description, deadline):
+        # Новое напоминание не обязательно подходит под запрос
+        pass
@@ -0,0 +1,101 @@
+"""Потоковый импорт напоминаний из CSV / JSONL.
+
+Файл читается построчно и передаётся в insert_deadlines пачками, так что
+в памяти никогда не находится больше одной пачки.
+
+Поля записи: name (обязательно), description, deadline (или date) -
+ISO-дата либо epoch-секунды.
+
+Использование:
+    python importer.py reminders.csv
+    python importer.py reminders.jsonl --chunk-size 10000
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import time
+
+from database import BULK_CHUNK_SIZE, create_table, insert_deadlines, to_epoch
+
+
+def _to_row(record, line_no):
+    name = (record.get('name') or '').strip()
+    deadline = record.get('deadline', record.get('date'))
+    if not name or deadline in (None, ''):
+        logging.warning(f"Строка {line_no}: нет name или deadline, пропущена")
+        return None
+    if isinstance(deadline, str) and deadline.strip().lstrip('-').isdigit():
+        deadline = int(deadline)
+    # Дату проверяем здесь: ошибка в insert_deadlines оборвала бы весь импорт
+    try:
+        deadline = to_epoch(deadline)
+    except (TypeError, ValueError, OverflowError, OSError):
+        logging.warning(f"Строка {line_no}: некорректный deadline {deadline!r}, пропущена")
+        return None
+    return name, record.get('description') or None, deadline
+
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        for line_no, record in enumerate(csv.DictReader(f), start=2):
+            row = _to_row(record, line_no)
+            if row is not None:
+                yield row
+
+
+def read_jsonl(path):
+    with open(path, encoding='utf-8') as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logging.warning(f"Строка {line_no}: некорректный JSON, пропущена")
+                continue
+            row = _to_row(record, line_no)
+            if row is not None:
+                yield row
+
+
+READERS = {
+    '.csv': read_csv,
+    '.jsonl': read_jsonl,
+    '.ndjson': read_jsonl,
+}
+
+
+def import_file(path, chunk_size=BULK_CHUNK_SIZE):
+    """Импортирует файл и возвращает (число строк, строк в секунду)"""
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in READERS:
+        raise ValueError(f"Неподдерживаемый формат файла: {ext}")
+
+    started = time.perf_counter()
+
+    def report(total):
+        elapsed = time.perf_counter() - started
+        logging.info(f"Импортировано {total} строк ({total / elapsed:.0f} строк/с)")
+
+    create_table()
+    total = insert_deadlines(READERS[ext](path), chunk_size=chunk_size, on_chunk=report)
+    elapsed = time.perf_counter() - started
+    return total, (total / elapsed if elapsed else 0.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Импорт напоминаний из CSV / JSONL")
+    parser.add_argument('path', help="файл .csv или .jsonl")
+    parser.add_argument('--chunk-size', type=int, default=BULK_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    total, rate = import_file(args.path, args.chunk_size)
+    print(f"Импортировано {total} строк, {rate:.0f} строк/с")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Постоянное хранилище запланированных писем.
+
+Письма лежат в таблице email_jobs рядом с напоминаниями и переживают
+перезапуск приложения. В APScheduler попадают только письма ближайшего
+окна (HORIZON): периодическая задача подгружает следующее окно индексным
+запросом, поэтому запуск не зависит от общего числа ожидающих писем.
+В момент срабатывания письмо лишь ставится в очередь outbox, а пропущенные
+за время простоя письма ставятся в неё одним запросом.
+"""
+import logging
+import threading
+from datetime import datetime, timedelta
+
+from apscheduler.triggers.date import DateTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+
+import database
+from database import from_epoch, to_epoch
+
+
+HORIZON = timedelta(minutes=10)
+
+
+class ReminderJobStore:
+    def __init__(self, scheduler, outbox, horizon=HORIZON):
+        self.scheduler = scheduler
+        self.outbox = outbox
+        self.horizon = horizon
+        self._loaded_until = None
+        self._lock = threading.Lock()
+
+    def rehydrate(self):
+        """Восстанавливает очередь писем при запуске"""
+        now = datetime.now()
+        self.scheduler.add_job(
+            self.catch_up, args=[now], id='email_catch_up', replace_existing=True
+        )
+        with self._lock:
+            self._loaded_until = now
+        self.refill()
+        self.scheduler.add_job(
+            self.refill,
+            IntervalTrigger(seconds=self.horizon.total_seconds() / 2),
+            id='email_refill',
+            replace_existing=True
+        )
+
+    def refill(self):
+        """Ставит в планировщик письма следующего окна"""
+        with self._lock:
+            end = datetime.now() + self.horizon
+            jobs = database.jobs_due_between(self._loaded_until, end)
+            for job_id, run_at in jobs:
+                self._schedule(job_id, run_at)
+            self._loaded_until = end
+        if jobs:
+            logging.info(f"Запланировано писем из базы: {len(jobs)}")
+
+    def add(self, reminder_id, recipient, run_at, subject, body, message=None, group_id=None):
+        """Сохраняет письмо и, если оно попадает в текущее окно, планирует его"""
+        job_id = database.add_email_job(
+            reminder_id, recipient, run_at, subject, body, message, group_id
+        )
+        self.register(job_id, run_at)
+        return job_id
+
+    def register(self, job_id, run_at):
+        """Планирует уже сохранённое письмо, если оно попадает в текущее окно"""
+        run_at = to_epoch(run_at)
+        with self._lock:
+            if self._loaded_until is None or run_at <= to_epoch(self._loaded_until):
+                self._schedule(job_id, run_at)
+            # Иначе письмо подхватит refill
+
+    def _schedule(self, job_id, run_at):
+        # from_epoch даёт наивное локальное время; без явной зоны APScheduler
+        # считал бы его временем в зоне планировщика, а она может не совпадать
+        # с зоной сервера
+        self.scheduler.add_job(
+            self.fire,
+            DateTrigger(run_date=from_epoch(run_at).astimezone()),
+            args=[job_id],
+            id=f"email_{job_id}",
+            replace_existing=True
+        )
+
+    def fire(self, job_id):
+        """Вызывается планировщиком: передаёт письмо в очередь отправки.
+
+        Если письмо уже отправлено или перепланировано на более позднее
+        время, enqueue ничего не делает.
+        """
+        self.outbox.enqueue(job_id)
+
+    def catch_up(self, until):
+        """Ставит в очередь письма, пропущенные пока приложение не работало"""
+        count = self.outbox.enqueue_overdue(until)
+        if count:
+            logging.info(f"Поставлено в очередь пропущенных писем: {count}")
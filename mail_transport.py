@@ -0,0 +1,253 @@
+"""Транспорт исходящей почты с пулом SMTP-сессий.
+
+Вместо нового подключения и логина на каждое письмо держим ограниченный
+пул авторизованных сессий и переиспользуем их между задачами. Простаивающие
+сессии проверяются командой NOOP, разорванные пересоздаются, а после
+max_messages писем сессия закрывается, чтобы не упереться в лимиты сервера.
+
+Письмо можно собрать заранее (render_message): MIME-структура, кодирование
+кириллицы в заголовках и тела в base64 выполняются при планировании, а при
+отправке по сети уходят готовые байты. Заголовок Date к ним добавляется в
+момент отправки, а Message-ID назначается при сборке. Одно письмо можно передать сразу
+нескольким адресатам (несколько RCPT TO в одной SMTP-транзакции) - так
+уходят рассылки группам.
+
+Параметры берутся из .env: YANDEX_LOGIN, YANDEX_PASSWORD, а также
+SMTP_HOST, SMTP_PORT и SMTP_SSL=0 - например, для локального aiosmtpd:
+    python -m aiosmtpd -n -l localhost:8025
+    SMTP_HOST=localhost SMTP_PORT=8025 SMTP_SSL=0
+"""
+import logging
+import os
+import smtplib
+import ssl
+import threading
+import time
+from email import policy
+from email.message import EmailMessage
+from email.utils import formatdate, make_msgid
+
+import metrics
+
+
+POOL_SIZE = 3
+MAX_MESSAGES_PER_CONNECTION = 50
+KEEPALIVE_INTERVAL = 60   # секунд простоя, после которых сессия проверяется NOOP
+ACQUIRE_TIMEOUT = 60
+SMTP_TIMEOUT = 30
+# Заголовок To рассылки: адреса участников группы друг другу не видны
+UNDISCLOSED_RECIPIENTS = 'undisclosed-recipients:;'
+
+
+def is_connection_error(error):
+    """True, если после ошибки сессию нельзя использовать повторно.
+
+    SMTPException наследуется от OSError, поэтому отказ по конкретному
+    письму (например, неверный адрес) отделяем от обрыва соединения.
+    """
+    if isinstance(error, (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError)):
+        return True
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code == 421
+    return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+
+def is_permanent_error(error):
+    """True для отказов 5xx: повторная отправка того же письма не поможет"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code >= 500
+    return False
+
+
+def build_message(sender, recipient, subject, html):
+    """Собирает HTML-письмо (заголовки с кириллицей кодируются автоматически)"""
+    message = EmailMessage()
+    message['From'] = sender
+    message['To'] = recipient
+    message['Subject'] = subject
+    message['Message-ID'] = make_msgid(domain=sender.rpartition('@')[2] or None)
+    message.set_content(html, subtype='html', cte='base64')
+    return message
+
+
+def stamp_date(message):
+    """Добавляет заголовок Date (время отправки) письму или байтам render_message"""
+    if isinstance(message, bytes):
+        return b'Date: ' + formatdate(localtime=True).encode('ascii') + b'\r\n' + message
+    if 'Date' not in message:
+        message['Date'] = formatdate(localtime=True)
+    return message
+
+
+def render_message(sender, recipient, subject, html):
+    """Готовое к передаче по SMTP письмо в байтах (строки через CRLF)"""
+    return build_message(sender, recipient, subject, html).as_bytes(policy=policy.SMTP)
+
+
+class SMTPSession:
+    def __init__(self, smtp):
+        self.smtp = smtp
+        self.messages_sent = 0
+        self.last_used = time.monotonic()
+
+    def close(self):
+        try:
+            self.smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            self.smtp.close()
+
+
+class SMTPConnectionPool:
+    def __init__(self, host, port, user=None, password=None, use_ssl=True, sender=None,
+                 size=POOL_SIZE, max_messages=MAX_MESSAGES_PER_CONNECTION,
+                 keepalive_interval=KEEPALIVE_INTERVAL):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.use_ssl = use_ssl
+        self.sender = sender or user
+        self.max_messages = max_messages
+        self.keepalive_interval = keepalive_interval
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = []
+        self._lock = threading.Lock()
+        self.connects = 0
+
+    def _connect(self):
+        started = time.perf_counter()
+        if self.use_ssl:
+            smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=SMTP_TIMEOUT,
+                                    context=ssl.create_default_context())
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=SMTP_TIMEOUT)
+        try:
+            if self.user:
+                smtp.login(self.user, self.password)
+        except BaseException:
+            smtp.close()
+            raise
+        metrics.smtp_connect_time.observe(time.perf_counter() - started)
+        metrics.smtp_connects.inc()
+        self.connects += 1
+        logging.debug(f"Открыта SMTP-сессия с {self.host}:{self.port}")
+        return SMTPSession(smtp)
+
+    @staticmethod
+    def _is_alive(session):
+        try:
+            return session.smtp.noop()[0] == 250
+        except OSError:
+            return False
+
+    def _acquire(self):
+        if not self._slots.acquire(timeout=ACQUIRE_TIMEOUT):
+            raise TimeoutError("Нет свободной SMTP-сессии")
+        try:
+            while True:
+                with self._lock:
+                    session = self._idle.pop() if self._idle else None
+                if session is None:
+                    return self._connect()
+                idle_for = time.monotonic() - session.last_used
+                if idle_for < self.keepalive_interval or self._is_alive(session):
+                    return session
+                session.close()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _release(self, session, broken=False):
+        session.last_used = time.monotonic()
+        if broken or session.messages_sent >= self.max_messages:
+            session.close()
+        else:
+            with self._lock:
+                self._idle.append(session)
+        self._slots.release()
+
+    def send(self, message, recipient=None):
+        """Отправляет письмо; при обрыве сессии один раз переподключается.
+
+        message - EmailMessage или байты из render_message (тогда нужен
+        recipient - адрес или список адресов). Возвращает отказы сервера
+        по отдельным адресатам: {адрес: (код, ответ)}.
+        """
+        if isinstance(recipient, str):
+            recipient = [recipient]
+        message = stamp_date(message)
+        for attempt in (1, 2):
+            session = self._acquire()
+            try:
+                with metrics.smtp_send_time.time():
+                    if isinstance(message, bytes):
+                        refused = session.smtp.sendmail(self.sender, recipient, message)
+                    else:
+                        refused = session.smtp.send_message(message)
+            except Exception as e:
+                broken = is_connection_error(e)
+                self._release(session, broken=broken)
+                if not broken or attempt == 2:
+                    raise
+                logging.warning("SMTP-сессия разорвана, переподключаемся")
+            else:
+                session.messages_sent += 1
+                self._release(session)
+                return refused
+
+    def keepalive(self):
+        """Проверяет простаивающие сессии NOOP и закрывает мёртвые"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        alive = []
+        for session in idle:
+            if time.monotonic() - session.last_used < self.keepalive_interval:
+                alive.append(session)
+            elif self._is_alive(session):
+                session.last_used = time.monotonic()
+                alive.append(session)
+            else:
+                session.close()
+        with self._lock:
+            self._idle.extend(alive)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for session in idle:
+            session.close()
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    """Общий пул SMTP-сессий, настроенный из переменных окружения"""
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                _transport = SMTPConnectionPool(
+                    host=os.getenv('SMTP_HOST', 'smtp.yandex.ru'),
+                    port=int(os.getenv('SMTP_PORT', '465')),
+                    user=os.getenv('YANDEX_LOGIN'),
+                    password=os.getenv('YANDEX_PASSWORD'),
+                    use_ssl=os.getenv('SMTP_SSL', '1') != '0',
+                    sender=os.getenv('SMTP_FROM') or os.getenv('YANDEX_LOGIN') or 'advtodo@localhost',
+                    size=int(os.getenv('SMTP_POOL_SIZE', POOL_SIZE)),
+                    max_messages=int(os.getenv('SMTP_MAX_MESSAGES', MAX_MESSAGES_PER_CONNECTION)),
+                )
+    return _transport
+
+
+def keepalive():
+    if _transport is not None:
+        _transport.keepalive()
+
+
+def close():
+    if _transport is not None:
+        _transport.close()
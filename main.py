@@ -1,24 +1,20 @@
 import sys
 from PyQt5 import QtWidgets, QtCore, QtGui
 from uiDesign.design import Ui_MainWindow
-from constants import COLORS, FONTS
-import os
+from constants import COLORS, FONTS, TEXTS, RECURRENCE_OPTIONS
 from dotenv import load_dotenv
 import logging
-import yagmail
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.date import DateTrigger
-import pytz
-from datetime import datetime, timedelta
+import threading
+from datetime import datetime
+from functools import partial
 from database import *
-from fpdf import FPDF
-import sqlite3
-from reportlab.pdfgen import canvas
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
+from db_connection import close_all
+from history_model import ReminderHistoryModel, SearchResultsModel
+from deadline_store import Deadline, DeadlineStore
+import db_writer
 
-
-create_table()
+# Планировщик, почта и PDF импортируются лениво (см. start_services и
+# export_db_to_pdf), чтобы окно появлялось как можно раньше
 
 
 logging.basicConfig(
@@ -29,100 +25,12 @@ load_dotenv()
 
 
 
-class PDF(FPDF):
-    def __init__(self):
-        super().__init__()
-        # Добавляем поддержку кириллицы через специальный шрифт
-        self.add_page()
-        self.add_font('DejaVu', '', 'DejaVuSans.ttf', uni=True)
-        self.add_font('DejaVu', 'B', 'DejaVuSans-Bold.ttf', uni=True)
-        self.set_auto_page_break(auto=True, margin=15)
-    
-    def header(self):
-        self.set_font('DejaVu', 'B', 14)
-        self.cell(0, 10, 'История напоминаний', 0, 1, 'C')
-        self.ln(5)
-        
-    def footer(self):
-        self.set_y(-15)
-        self.set_font('DejaVu', 'I', 8)
-        self.cell(0, 10, f'Страница {self.page_no()}', 0, 0, 'C')
-
-def export_db_to_pdf(self):
-    """Экспортирует данные из database.db в PDF с поддержкой кириллицы"""
-    try:
-        # Подключаемся к базе данных
-        conn = sqlite3.connect('database.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT name, description, date FROM advToDo ORDER BY date DESC")
-        db_data = cursor.fetchall()
-        conn.close()
-
-        if not db_data:
-            QtWidgets.QMessageBox.information(self, "Информация", "База данных пуста")
-            return
-
-        # Создаем PDF документ
-        pdf = PDF()
-        pdf.add_page()
-        pdf.set_font('DejaVu', '', 10)
-
-        # Информация о экспорте
-        pdf.cell(0, 10, f'Дата экспорта: {datetime.now().strftime("%d.%m.%Y %H:%M")}', 0, 1)
-        pdf.ln(10)
-
-        # Данные из базы
-        for name, description, date in db_data:
-            try:
-                date_obj = datetime.strptime(date, "%Y-%m-%d %H:%M:%S")
-                date_str = date_obj.strftime("%d.%m.%Y %H:%M")
-            except:
-                date_str = date
-
-            # Дата
-            pdf.set_font('DejaVu', 'B', 10)
-            pdf.cell(40, 10, 'Дата:', 0, 0)
-            pdf.set_font('DejaVu', '', 10)
-            pdf.cell(0, 10, date_str, 0, 1)
-            
-            # Название
-            pdf.set_font('DejaVu', 'B', 10)
-            pdf.cell(40, 10, 'Название:', 0, 0)
-            pdf.set_font('DejaVu', '', 10)
-            pdf.multi_cell(0, 10, name)
-            
-            # Описание
-            pdf.set_font('DejaVu', 'B', 10)
-            pdf.cell(40, 10, 'Описание:', 0, 0)
-            pdf.set_font('DejaVu', '', 10)
-            if description:
-                pdf.multi_cell(0, 10, description)
-            else:
-                pdf.cell(0, 10, 'Нет описания', 0, 1)
-            
-            pdf.ln(5)
-
-        # Сохраняем файл
-        file_name = f"database_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-        pdf.output(file_name)
-
-        # Показываем сообщение об успехе
-        QtWidgets.QMessageBox.information(
-            self,
-            "Экспорт базы данных",
-            f"Данные успешно экспортированы в:\n{file_name}"
-        )
-
-    except Exception as e:
-        QtWidgets.QMessageBox.critical(
-            self,
-            "Ошибка экспорта",
-            f"Не удалось экспортировать данные:\n{str(e)}"
-        )
-
 class EmailSenderApp(QtWidgets.QMainWindow, Ui_MainWindow):
     email_sent_signal = QtCore.pyqtSignal(str, str)  # recipient, time
     email_error_signal = QtCore.pyqtSignal(str)      # error_msg
+    db_write_done = QtCore.pyqtSignal(object, object)  # handler, future
+    engine_started = QtCore.pyqtSignal(object)         # None или ошибка запуска
+    stats_ready = QtCore.pyqtSignal(object)            # сводка metrics.summary()
 
     def __init__(self):
         super().__init__()
@@ -132,20 +40,22 @@ class EmailSenderApp(QtWidgets.QMainWindow, Ui_MainWindow):
         # Подключаем сигналы к слотам
         self.email_sent_signal.connect(self.show_email_sent_message)
         self.email_error_signal.connect(self.show_email_error_message)
-
-        self.scheduler = BackgroundScheduler(
-            timezone='Europe/Moscow',  # Укажите ваш часовой пояс
-            daemon=True,
-            job_defaults={
-                'misfire_grace_time': 300,
-                'coalesce': True,
-                'max_instances': 3
-            }
-        )
-        self.scheduler.start()
-        
-        self.deadlines = []
-        self.yag = None  # Теперь не храним соединение постоянно
+        self.db_write_done.connect(self._on_db_write_done)
+        self.engine_started.connect(self.on_engine_started)
+        self.stats_ready.connect(self.on_stats_ready)
+
+        # Планирование и доставку писем ведёт движок (engine.py), окно - лишь
+        # один из его клиентов. Движок запускается после первой отрисовки окна
+        # (см. paintEvent) или при первом планировании письма
+        self.engine = None
+        self._services_pending = True
+        self._engine_ready = False
+        # Письма, сохранённые до запуска движка: передаются ему после запуска
+        self._pending_registrations = []
+        self._stats_running = False
+        self._schema_ready = False
+
+        self.deadlines = DeadlineStore()
         
         # Подключение сигналов
         self.checkBox.stateChanged.connect(self.toggle_notification)
@@ -176,11 +86,193 @@ class EmailSenderApp(QtWidgets.QMainWindow, Ui_MainWindow):
         """)
         self.exportButton.clicked.connect(self.export_db_to_pdf)
 
+        # Повтор напоминания рядом с выбором даты
+        self.recurrenceBox = QtWidgets.QComboBox(self.groupBox)
+        self.recurrenceBox.setGeometry(230, 240, 150, 30)
+        self.recurrenceBox.setFont(FONTS['regular'])
+        for label, rule in RECURRENCE_OPTIONS:
+            self.recurrenceBox.addItem(label, rule)
+
+        # История напоминаний: вместо текстового поля - список с моделью,
+        # которая подгружает строки из базы страницами по мере прокрутки
+        self.history_model = ReminderHistoryModel(self)
+        history_geometry = self.tdmainbody.geometry()
+
+        # Полнотекстовый поиск по истории; запрос выполняется после паузы в наборе
+        self.searchInput = QtWidgets.QLineEdit(self.groupBox)
+        self.searchInput.setGeometry(
+            history_geometry.x(), history_geometry.y(), history_geometry.width(), 28
+        )
+        self.searchInput.setFont(FONTS['regular'])
+        self.searchInput.setPlaceholderText(TEXTS['search_placeholder'])
+        self.searchInput.setClearButtonEnabled(True)
+        self.searchInput.setStyleSheet(f"""
+            QLineEdit {{
+                border: 1px solid #ccc;
+                border-radius: 4px;
+                padding: 5px;
+            }}
+        """)
+        self.search_timer = QtCore.QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(250)
+        self.search_timer.timeout.connect(self.apply_search)
+        self.searchInput.textChanged.connect(self.search_timer.start)
+
+        self.historyView = QtWidgets.QListView(self.groupBox)
+        self.historyView.setGeometry(history_geometry.adjusted(0, 34, 0, 0))
+        self.historyView.setMinimumHeight(self.tdmainbody.minimumHeight() - 34)
+        self.historyView.setStyleSheet(f"""
+            QListView {{
+                border: 1px solid #ccc;
+                border-radius: 4px;
+                padding: 15px;
+                font-size: 12px;
+            }}
+        """)
+        self.historyView.setUniformItemSizes(True)
+        self.historyView.setTextElideMode(QtCore.Qt.ElideRight)
+        self.historyView.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.tdmainbody.hide()
+        # Кнопка экспорта лежит поверх области истории
+        self.exportButton.raise_()
+
+        # Панель статистики доставки в строке состояния
+        self.statsLabel = QtWidgets.QLabel(self)
+        self.statsLabel.setFont(FONTS['regular'])
+        self.statusBar().addPermanentWidget(self.statsLabel)
+        self.stats_timer = QtCore.QTimer(self)
+        self.stats_timer.setInterval(5000)
+        self.stats_timer.timeout.connect(self.refresh_stats)
+
+        # Схема (миграции, в том числе перестроение FTS-индекса) обновляется
+        # потоком-писателем; история и поиск подключаются после этого.
+        # Записи из окна встают в ту же очередь, то есть идут после миграций
+        self.searchInput.setEnabled(False)
+        self.submit_write(self.on_schema_ready, create_table)
+
+    def apply_search(self):
+        """Показывает результаты поиска или, при пустом запросе, всю историю"""
+        text = self.searchInput.text().strip()
+        previous = self.historyView.model()
+        if text:
+            self.historyView.setModel(SearchResultsModel(text, self))
+        else:
+            self.historyView.setModel(self.history_model)
+        if previous is not self.history_model:
+            previous.deleteLater()
+
+    def on_schema_ready(self, future):
+        """База готова к работе (вызывается через сигнал)"""
+        try:
+            future.result()
+        except Exception as e:
+            logging.exception("Не удалось обновить схему базы данных")
+            QtWidgets.QMessageBox.critical(
+                self, "Ошибка базы данных", f"Не удалось открыть базу данных:\n{e}"
+            )
+            return
+        self._schema_ready = True
+        self.historyView.setModel(self.history_model)
+        self.searchInput.setEnabled(True)
+        if not self._services_pending:
+            # Окно уже отрисовано, но движок ждал схему
+            self.start_services()
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if self._services_pending:
+            self._services_pending = False
+            # Окно уже на экране - запускаем фоновые службы на следующем такте
+            QtCore.QTimer.singleShot(0, self.start_services)
+
+    def start_services(self):
+        """Запускает движок напоминаний (при простое или первой необходимости)"""
+        if self.engine is not None or not self._schema_ready:
+            return
+        from engine import ReminderEngine
+
+        self.engine = ReminderEngine()
+        self.engine.add_listener(on_sent=self.on_email_sent, on_failed=self.on_email_failed)
+        # Миграции, восстановление писем и перепланирование повторов пишут
+        # в базу - запускаем движок не в GUI-потоке
+        threading.Thread(target=self._start_engine, name='engine-start', daemon=True).start()
+
+    def _start_engine(self):
+        try:
+            self.engine.start()
+        except Exception as e:
+            logging.exception("Не удалось запустить движок напоминаний")
+            self.engine_started.emit(e)
+        else:
+            self.engine_started.emit(None)
+
+    def on_engine_started(self, error):
+        """Движок запущен (вызывается через сигнал)"""
+        if error is not None:
+            self.show_email_error_message(f"Не удалось запустить отправку писем: {error}")
+            return
+        self._engine_ready = True
+        pending, self._pending_registrations = self._pending_registrations, []
+        for job_id, run_at in pending:
+            self.engine.register(job_id, run_at)
+        self.refresh_stats()
+        self.stats_timer.start()
+
+    def refresh_stats(self):
+        """Запрашивает сводку доставки писем (глубина очереди читается из базы - в фоне)"""
+        if self._stats_running:
+            return
+        self._stats_running = True
+        threading.Thread(target=self._collect_stats, name='stats', daemon=True).start()
+
+    def _collect_stats(self):
+        import metrics
+
+        try:
+            stats = metrics.summary()
+        except Exception:
+            logging.exception("Не удалось собрать статистику доставки")
+            stats = None
+        self.stats_ready.emit(stats)
+
+    def on_stats_ready(self, stats):
+        """Обновляет панель статистики доставки писем (вызывается через сигнал)"""
+        self._stats_running = False
+        if stats is None:
+            return
+        queue = stats['queue']
+        lag = '-' if stats['lag_p95'] is None else f"≤{stats['lag_p95']:g} с"
+        self.statsLabel.setText(
+            f"Отправлено: {stats['sent']}   Ошибок: {stats['failed']}   "
+            f"Повторов: {stats['retried']}   Пропусков: {stats['misfires']}   "
+            f"Ждут: {queue.get('pending', 0)}   В очереди: {queue.get('queued', 0)}   "
+            f"Опоздание p95: {lag}"
+        )
+
+    def shutdown_services(self):
+        """Дописывает очередь записи в базу и останавливает движок"""
+        self.stats_timer.stop()
+        db_writer.stop()
+        if self.engine is not None:
+            self.engine.stop()
+
+    def submit_write(self, handler, fn, *args, **kwargs):
+        """Выполняет запись в базу в фоновом потоке-писателе (db_writer.py).
+
+        handler(future) вызывается в GUI-потоке после коммита.
+        """
+        future = db_writer.submit(fn, *args, **kwargs)
+        future.add_done_callback(lambda done: self.db_write_done.emit(handler, done))
+
+    def _on_db_write_done(self, handler, future):
+        handler(future)
+
     def toggle_notification(self, state):
         if state == QtCore.Qt.Checked:
             self.add_deadline()
     
-    def add_deadline(self):
+    def add_deadline(self, recipient=None):
         deadline_text = self.tdname.toPlainText().strip()
         deadline_details = self.tdDetails.toPlainText().strip()
         deadline_datetime = self.dateTimeEdit.dateTime().toPyDateTime()
@@ -192,29 +284,39 @@ class EmailSenderApp(QtWidgets.QMainWindow, Ui_MainWindow):
             self.checkBox.setChecked(False)
             return
 
-        self.deadlines.append({
-            'datetime': deadline_datetime,
-            'description': deadline_text,
-            'details': deadline_details,
-            'notified': False
-        })
-
-        insert_deadline(deadline_text, deadline_details, deadline_datetime)
-
-
-        current_text = self.tdmainbody.toPlainText()
+        # Окно не ждёт диска: напоминание появится, когда запись закоммитится
+        self.submit_write(
+            partial(self.on_deadline_saved, deadline_text, deadline_details,
+                    deadline_datetime, recipient),
+            insert_deadline, deadline_text, deadline_details, deadline_datetime,
+            recurrence=self.recurrenceBox.currentData()
+        )
 
-        details_text = f"\n{deadline_details}" if deadline_details else ""
-        new_text = f"{deadline_datetime.strftime('%d.%m.%Y %H:%M')} - {deadline_text}{details_text}\n\n{current_text}"
-        self.tdmainbody.setPlainText(new_text)
         self.tdname.clear()
         self.tdDetails.clear()
-        self.tdmainbody.setLineWrapMode(QtWidgets.QTextEdit.WidgetWidth)
-        self.tdmainbody.setWordWrapMode(QtGui.QTextOption.WordWrap)
-        
+        self.recurrenceBox.setCurrentIndex(0)
+
         # Автоматически отжимаем чекбокс после создания дедлайна
         self.checkBox.setChecked(False)
 
+    def on_deadline_saved(self, deadline_text, deadline_details, deadline_datetime,
+                          recipient, future):
+        """Напоминание сохранено в базе; recipient - кому сразу запланировать письмо"""
+        try:
+            reminder_id = future.result()
+        except Exception as e:
+            logging.exception("Не удалось сохранить напоминание")
+            QtWidgets.QMessageBox.critical(self, "Ошибка", f"Не удалось сохранить напоминание:\n{e}")
+            return
+
+        deadline = Deadline(reminder_id, deadline_datetime, deadline_text, deadline_details)
+        self.deadlines.add(deadline)
+        self.history_model.prepend(
+            reminder_id, deadline_text, deadline_details, to_epoch(deadline_datetime)
+        )
+        if recipient:
+            self.schedule_email(deadline, recipient)
+
     def send_email_notification(self):
         """Обработчик нажатия кнопки отправки"""
         email = self.emailInput.text().strip()
@@ -226,30 +328,17 @@ class EmailSenderApp(QtWidgets.QMainWindow, Ui_MainWindow):
             QtWidgets.QMessageBox.warning(self, "Ошибка", "Введите текст напоминания")
             return
 
-        if not self.deadlines:
-            self.add_deadline()
-
-
-        last_deadline = self.deadlines[-1]
-
-        self.schedule_email(last_deadline, email)
+        if self.deadlines.last_added is None:
+            # Письмо запланируется, когда напоминание сохранится в базе
+            self.add_deadline(recipient=email)
+            return
 
-        
-        # Уведомление об успешной планировке
-        success_msg = QtWidgets.QMessageBox()
-        success_msg.setIcon(QtWidgets.QMessageBox.Information)
-        success_msg.setWindowTitle("Успешно!")
-        success_msg.setText(f"Напоминание запланировано!")
-        success_msg.setInformativeText(
-            f"Письмо будет отправлено на адрес:\n{email}\n"
-            f"в указанное время:\n{last_deadline['datetime'].strftime('%d.%m.%Y %H:%M')}"
-        )
-        success_msg.exec_()
+        self.schedule_email(self.deadlines.last_added, email)
 
     def schedule_email(self, deadline, recipient):
         """Планирует отправку email на указанное время"""
         now = datetime.now()
-        deadline_time = deadline['datetime']
+        deadline_time = deadline.datetime
 
         if deadline_time <= now:
             QtWidgets.QMessageBox.warning(
@@ -261,143 +350,128 @@ class EmailSenderApp(QtWidgets.QMainWindow, Ui_MainWindow):
             )
             return
 
-        subject = "Напоминание: " + deadline['description']
-        body = f"""
-        <h2>Напоминание</h2>
-        <p><strong>Дата и время:</strong> {deadline_time.strftime('%d.%m.%Y %H:%M')}</p>
-        <p><strong>Описание:</strong> {deadline['description']}</p>
-        """
-
-        job_id = f"email_{deadline_time.timestamp()}_{recipient}"
+        # Письмо сохраняется в базе, повторное планирование перезаписывает его
+        self.start_services()
+        # В транзакции писателя только запись в базу; планировщику письмо
+        # передаётся после коммита (on_email_scheduled)
+        self.submit_write(
+            partial(self.on_email_scheduled, deadline_time, recipient),
+            self.engine.store_reminder,
+            deadline.id, recipient, deadline_time, deadline.description
+        )
 
+    def on_email_scheduled(self, deadline_time, email, future):
+        """Письмо сохранено в базе - передаём его планировщику"""
         try:
-            self.scheduler.remove_job(job_id)
-        except:
-            pass
-        
-        # Передаем deadline_time вместо всего deadline
-        self.scheduler.add_job(
-            self.send_email,
-            DateTrigger(run_date=deadline_time),
-            args=[subject, body, recipient, deadline_time],  # Добавляем deadline_time в аргументы
-            id=job_id
-        )
+            job_id = future.result()
+        except Exception as e:
+            logging.exception("Не удалось запланировать письмо")
+            self.show_email_error_message(f"Не удалось запланировать письмо на {email}: {e}")
+            return
+        if self._engine_ready:
+            self.engine.register(job_id, deadline_time)
+        else:
+            self._pending_registrations.append((job_id, deadline_time))
 
         QtWidgets.QMessageBox.information(
             self,
             "Запланировано",
             f"Письмо будет отправлено в {deadline_time.strftime('%d.%m.%Y %H:%M')}"
         )
-    def send_email(self, subject, body, recipient, deadline_time):
-        """Отправляет email (вызывается планировщиком)"""
-        try:
-            yag = yagmail.SMTP(
-                user=os.getenv('YANDEX_LOGIN'),
-                password=os.getenv('YANDEX_PASSWORD'),
-                host='smtp.yandex.ru',
-                port=465,
-                smtp_ssl=True
-            )
 
-            yag.send(to=recipient, subject=subject, contents=body)
-            logging.info(f"Письмо успешно отправлено на {recipient}")
+        # Уведомление об успешной планировке
+        success_msg = QtWidgets.QMessageBox()
+        success_msg.setIcon(QtWidgets.QMessageBox.Information)
+        success_msg.setWindowTitle("Успешно!")
+        success_msg.setText(f"Напоминание запланировано!")
+        success_msg.setInformativeText(
+            f"Письмо будет отправлено на адрес:\n{email}\n"
+            f"в указанное время:\n{deadline_time.strftime('%d.%m.%Y %H:%M')}"
+        )
+        success_msg.exec_()
+    def on_email_sent(self, job):
+        """Письмо доставлено (вызывается диспетчером очереди)"""
+        self.deadlines.mark_notified(job['reminder_id'])
+        deadline_time = from_epoch(job['run_at'])
+        self.email_sent_signal.emit(job['recipient'], deadline_time.strftime('%d.%m.%Y %H:%M'))
 
-            # Используем переданное deadline_time
-            self.email_sent_signal.emit(recipient, deadline_time.strftime('%d.%m.%Y %H:%M'))
+    def on_email_failed(self, job, error):
+        """Все попытки отправки исчерпаны (вызывается диспетчером очереди)"""
+        self.email_error_signal.emit(f"Ошибка отправки на {job['recipient']}: {error}")
 
-        except Exception as e:
-            error_msg = f"Ошибка отправки: {str(e)}"
-            logging.error(error_msg, exc_info=True)
-            self.email_error_signal.emit(error_msg)
+    def export_db_to_pdf(self):
+        """Запускает экспорт базы в PDF в фоновом потоке"""
+        if getattr(self, 'export_thread', None) is not None:
+            QtWidgets.QMessageBox.information(self, "Информация", "Экспорт уже выполняется")
+            return
 
-        finally:
-            if 'yag' in locals():
-                try:
-                    yag.close()
-                except:
-                    pass
+        from pdf_export import ExportWorker
+
+        file_name = f"database_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+
+        # Число напоминаний считает рабочий поток и сообщает первым progress
+        self.export_progress = QtWidgets.QProgressDialog(
+            "Экспорт базы данных в PDF...", "Отмена", 0, 0, self
+        )
+        self.export_progress.setWindowTitle("Экспорт базы данных")
+        self.export_progress.setWindowModality(QtCore.Qt.WindowModal)
+        self.export_progress.setMinimumDuration(500)
+
+        self.export_thread = QtCore.QThread(self)
+        self.export_worker = ExportWorker(file_name)
+        self.export_worker.moveToThread(self.export_thread)
+
+        self.export_thread.started.connect(self.export_worker.run)
+        self.export_worker.progress.connect(self.on_export_progress)
+        self.export_worker.finished.connect(self.on_export_finished)
+        self.export_worker.failed.connect(self.on_export_failed)
+        self.export_worker.cancelled.connect(self.on_export_cancelled)
+        self.export_worker.empty.connect(self.on_export_empty)
+        # cancel() только выставляет флаг, поэтому вызываем его напрямую из GUI-потока
+        self.export_progress.canceled.connect(self.export_worker.cancel, QtCore.Qt.DirectConnection)
+
+        self.export_thread.start()
+
+    def on_export_progress(self, done, total):
+        if self.export_progress is not None:
+            self.export_progress.setMaximum(total)
+            self.export_progress.setValue(done)
+
+    def _finish_export(self):
+        self.export_progress.close()
+        self.export_progress = None
+        self.export_thread.quit()
+        self.export_thread.wait()
+        self.export_worker.deleteLater()
+        self.export_thread.deleteLater()
+        self.export_thread = None
+        self.export_worker = None
+
+    def on_export_finished(self, file_name):
+        self._finish_export()
+        # Показываем сообщение об успехе
+        QtWidgets.QMessageBox.information(
+            self,
+            "Экспорт базы данных",
+            f"Данные успешно экспортированы в:\n{file_name}"
+        )
+
+    def on_export_failed(self, error_msg):
+        self._finish_export()
+        QtWidgets.QMessageBox.critical(
+            self,
+            "Ошибка экспорта",
+            f"Не удалось экспортировать данные:\n{error_msg}"
+        )
+
+    def on_export_empty(self):
+        self._finish_export()
+        QtWidgets.QMessageBox.information(self, "Информация", "База данных пуста")
+
+    def on_export_cancelled(self):
+        self._finish_export()
+        QtWidgets.QMessageBox.information(self, "Экспорт базы данных", "Экспорт отменён")
 
-    def export_db_to_pdf(self):
-        """Экспортирует данные из database.db в PDF с поддержкой кириллицы"""
-        try:
-            # Подключаемся к базе данных
-            conn = sqlite3.connect('database.db')
-            cursor = conn.cursor()
-            cursor.execute("SELECT name, description, date FROM advToDo ORDER BY date DESC")
-            db_data = cursor.fetchall()
-            conn.close()
-    
-            if not db_data:
-                QtWidgets.QMessageBox.information(self, "Информация", "База данных пуста")
-                return
-    
-            # Создаем PDF документ с поддержкой Unicode
-            pdf = FPDF()
-            pdf.add_page()
-            
-            # Добавляем шрифты DejaVu с поддержкой кириллицы
-            pdf.add_font('DejaVu', '', 'DejaVuSans.ttf', uni=True)
-            pdf.add_font('DejaVu', 'B', 'DejaVuSans-Bold.ttf', uni=True)
-            pdf.set_font('DejaVu', '', 10)
-    
-            # Заголовок
-            pdf.set_font('DejaVu', 'B', 14)
-            pdf.cell(0, 10, 'История напоминаний', 0, 1, 'C')
-            pdf.ln(5)
-    
-            # Информация о экспорте
-            pdf.set_font('DejaVu', '', 10)
-            pdf.cell(0, 10, f'Дата экспорта: {datetime.now().strftime("%d.%m.%Y %H:%M")}', 0, 1)
-            pdf.ln(10)
-    
-            # Данные из базы
-            for name, description, date in db_data:
-                try:
-                    date_obj = datetime.strptime(date, "%Y-%m-%d %H:%M:%S")
-                    date_str = date_obj.strftime("%d.%m.%Y %H:%M")
-                except:
-                    date_str = date
-    
-                # Дата
-                pdf.set_font('DejaVu', 'B', 10)
-                pdf.cell(40, 10, 'Дата:', 0, 0)
-                pdf.set_font('DejaVu', '', 10)
-                pdf.cell(0, 10, date_str, 0, 1)
-                
-                # Название
-                pdf.set_font('DejaVu', 'B', 10)
-                pdf.cell(40, 10, 'Название:', 0, 0)
-                pdf.set_font('DejaVu', '', 10)
-                pdf.multi_cell(0, 10, name)
-                
-                # Описание
-                pdf.set_font('DejaVu', 'B', 10)
-                pdf.cell(40, 10, 'Описание:', 0, 0)
-                pdf.set_font('DejaVu', '', 10)
-                if description:
-                    pdf.multi_cell(0, 10, description)
-                else:
-                    pdf.cell(0, 10, 'Нет описания', 0, 1)
-                
-                pdf.ln(5)
-    
-            # Сохраняем файл
-            file_name = f"database_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-            pdf.output(file_name)
-    
-            # Показываем сообщение об успехе
-            QtWidgets.QMessageBox.information(
-                self,
-                "Экспорт базы данных",
-                f"Данные успешно экспортированы в:\n{file_name}"
-            )
-    
-        except Exception as e:
-            QtWidgets.QMessageBox.critical(
-                self,
-                "Ошибка экспорта",
-                f"Не удалось экспортировать данные:\n{str(e)}"
-            )
     def show_email_sent_message(self, recipient, deadline_time):
         """Показывает сообщение об успешной отправке (вызывается через сигнал)"""
         QtWidgets.QMessageBox.information(
@@ -428,7 +502,8 @@ def main():
     
     window = EmailSenderApp()
     window.show()
-    app.aboutToQuit.connect(window.scheduler.shutdown)
+    app.aboutToQuit.connect(window.shutdown_services)
+    app.aboutToQuit.connect(close_all)
     sys.exit(app.exec_())
 if __name__ == "__main__":
     main()
\ No newline at end of file
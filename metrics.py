@@ -0,0 +1,240 @@
+"""Метрики конвейера отправки писем.
+
+Счётчики и гистограммы задержек накапливаются в памяти процесса и
+отдаются в текстовом формате Prometheus: HTTP-эндпоинтом (serve) или
+файлом для textfile-коллектора node_exporter (write_file). Глубина
+очереди считается по таблице email_jobs в момент чтения метрик.
+
+    ADVTODO_METRICS_PORT=9464  - отдавать /metrics на localhost:9464
+    ADVTODO_METRICS_FILE=path  - переписывать файл каждые 15 секунд
+"""
+import bisect
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+METRICS_PORT = os.getenv('ADVTODO_METRICS_PORT')
+METRICS_FILE = os.getenv('ADVTODO_METRICS_FILE')
+FILE_INTERVAL = 15
+
+# Границы корзин гистограмм, сек
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+LAG_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 6 * 3600, 86400)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+class Counter:
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.type = 'counter'
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values) or {(): 0}
+        for labels, value in values.items():
+            yield self.name, labels, value
+
+
+class Histogram:
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.type = 'histogram'
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._sum += value
+            self._count += 1
+
+    def time(self):
+        """Контекстный менеджер: наблюдает длительность блока"""
+        return _Timer(self)
+
+    @property
+    def count(self):
+        return self._count
+
+    def quantile(self, q):
+        """Оценка квантиля по корзинам (верхняя граница корзины)"""
+        with self._lock:
+            counts, total = list(self._counts), self._count
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def samples(self):
+        with self._lock:
+            counts, total, value_sum = list(self._counts), self._count, self._sum
+        cumulative = 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            yield self.name + '_bucket', (('le', f'{bound:g}'),), cumulative
+        yield self.name + '_bucket', (('le', '+Inf'),), total
+        yield self.name + '_sum', (), value_sum
+        yield self.name + '_count', (), total
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+class Gauge:
+    """Значение, которое вычисляется при чтении: fn() -> число или {метка: число}"""
+
+    def __init__(self, name, documentation, fn, label=None):
+        self.name = name
+        self.documentation = documentation
+        self.type = 'gauge'
+        self.fn = fn
+        self.label = label
+
+    def samples(self):
+        try:
+            value = self.fn()
+        except Exception:
+            logging.exception(f"Не удалось вычислить метрику {self.name}")
+            return
+        if isinstance(value, dict):
+            for label_value, v in value.items():
+                yield self.name, ((self.label, label_value),), v
+        else:
+            yield self.name, (), value
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {value:g}")
+        return '\n'.join(lines) + '\n'
+
+
+def _queue_depth():
+    import database
+    return database.job_status_counts()
+
+
+REGISTRY = Registry()
+
+emails_sent = REGISTRY.register(Counter(
+    'advtodo_emails_sent_total', "Доставленные напоминания"))
+emails_failed = REGISTRY.register(Counter(
+    'advtodo_emails_failed_total', "Напоминания, не доставленные после всех попыток"))
+emails_retried = REGISTRY.register(Counter(
+    'advtodo_emails_retried_total', "Повторные попытки отправки"))
+messages_saved = REGISTRY.register(Counter(
+    'advtodo_digest_messages_saved_total', "Письма, заменённые дайджестами"))
+misfires = REGISTRY.register(Counter(
+    'advtodo_scheduler_misfires_total', "Задачи планировщика, пропустившие misfire_grace_time"))
+smtp_connects = REGISTRY.register(Counter(
+    'advtodo_smtp_connects_total', "Открытые SMTP-сессии"))
+fanout_recipients = REGISTRY.register(Counter(
+    'advtodo_fanout_recipients_total', "Адресаты рассылок группам по итогу попытки"))
+
+schedule_lag = REGISTRY.register(Histogram(
+    'advtodo_email_schedule_lag_seconds', "Насколько позже срока ушло письмо", LAG_BUCKETS))
+smtp_connect_time = REGISTRY.register(Histogram(
+    'advtodo_smtp_connect_seconds', "Подключение и логин SMTP"))
+smtp_send_time = REGISTRY.register(Histogram(
+    'advtodo_smtp_send_seconds', "Передача одного письма по SMTP"))
+delivery_time = REGISTRY.register(Histogram(
+    'advtodo_email_delivery_seconds', "Доставка от выборки из очереди до результата"))
+
+queue_depth = REGISTRY.register(Gauge(
+    'advtodo_email_jobs', "Письма в таблице email_jobs по статусам", _queue_depth, 'status'))
+
+
+def summary():
+    """Короткая сводка для панели в окне"""
+    return {
+        'sent': emails_sent.value(),
+        'failed': emails_failed.value(),
+        'retried': emails_retried.value(),
+        'misfires': misfires.value(),
+        'lag_p50': schedule_lag.quantile(0.5),
+        'lag_p95': schedule_lag.quantile(0.95),
+        'send_p95': smtp_send_time.quantile(0.95),
+        'queue': _queue_depth(),
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, host='127.0.0.1'):
+    """Поднимает HTTP-эндпоинт /metrics в фоновом потоке; возвращает сервер"""
+    server = ThreadingHTTPServer((host, int(port)), _Handler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logging.info(f"Метрики доступны на http://{host}:{server.server_port}/metrics")
+    return server
+
+
+def write_file(path):
+    """Атомарно переписывает файл с метриками (для textfile-коллектора)"""
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(REGISTRY.render())
+    os.replace(tmp, path)
@@ -0,0 +1,223 @@
+"""Версионированные миграции схемы базы.
+
+Текущая версия схемы хранится в PRAGMA user_version. Каждая миграция -
+функция, которая получает соединение и выполняется в отдельной
+транзакции; после неё user_version увеличивается.
+"""
+import logging
+from datetime import datetime
+
+from db_connection import connection, transaction
+
+
+def _legacy_table(conn):
+    """Исходная нетипизированная таблица (как в первых версиях приложения)"""
+    conn.execute("""Create table if not exists advToDo
+        (
+            id INTEGER PRIMARY KEY,
+            name Not Null,
+            description,
+            date Not Null
+        )
+        """)
+
+
+def _parse_legacy_date(value):
+    """Переводит str(datetime) из старой колонки date в epoch-секунды"""
+    if isinstance(value, (int, float)):
+        return int(value)
+    try:
+        return int(datetime.fromisoformat(str(value)).timestamp())
+    except ValueError:
+        logging.warning(f"Не удалось разобрать дату напоминания: {value!r}")
+        return 0
+
+
+def _typed_schema(conn):
+    """Типизированная схема: deadline в epoch-секундах, статус и индексы"""
+    conn.execute("""CREATE TABLE advToDo_new
+        (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            description TEXT,
+            deadline INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            created_at INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
+        )
+        """)
+    now = int(datetime.now().timestamp())
+    rows = []
+    for row_id, name, description, date in conn.execute(
+            "SELECT id, name, description, date FROM advToDo"):
+        deadline = _parse_legacy_date(date)
+        rows.append((row_id, name, description, deadline,
+                     'pending' if deadline > now else 'done'))
+    conn.executemany(
+        "INSERT INTO advToDo_new(id, name, description, deadline, status) VALUES (?,?,?,?,?)",
+        rows
+    )
+    conn.execute("DROP TABLE advToDo")
+    conn.execute("ALTER TABLE advToDo_new RENAME TO advToDo")
+    conn.execute("CREATE INDEX idx_advToDo_deadline ON advToDo(deadline)")
+    conn.execute("CREATE INDEX idx_advToDo_status_deadline ON advToDo(status, deadline)")
+
+
+def _email_jobs(conn):
+    """Очередь запланированных писем рядом с таблицей напоминаний"""
+    conn.execute("""CREATE TABLE email_jobs
+        (
+            id INTEGER PRIMARY KEY,
+            reminder_id INTEGER NOT NULL REFERENCES advToDo(id) ON DELETE CASCADE,
+            recipient TEXT NOT NULL,
+            run_at INTEGER NOT NULL,
+            subject TEXT NOT NULL,
+            body TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            sent_at INTEGER,
+            UNIQUE (reminder_id, recipient)
+        )
+        """)
+    conn.execute("CREATE INDEX idx_email_jobs_status_run_at ON email_jobs(status, run_at)")
+
+
+def _delivery_state(conn):
+    """Состояние доставки: попытки, время следующей попытки и последняя ошибка"""
+    conn.execute("ALTER TABLE email_jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+    conn.execute("ALTER TABLE email_jobs ADD COLUMN next_attempt_at INTEGER")
+    conn.execute("ALTER TABLE email_jobs ADD COLUMN last_error TEXT")
+    conn.execute(
+        "CREATE INDEX idx_email_jobs_status_next_attempt ON email_jobs(status, next_attempt_at)"
+    )
+    conn.execute("ALTER TABLE advToDo ADD COLUMN sent_at INTEGER")
+    conn.execute("ALTER TABLE advToDo ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+    conn.execute("ALTER TABLE advToDo ADD COLUMN last_error TEXT")
+
+
+def _full_text_search(conn):
+    """FTS5-индекс по name/description, синхронизируемый триггерами"""
+    conn.execute("""CREATE VIRTUAL TABLE advToDo_fts USING fts5(
+            name, description,
+            content='advToDo', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )""")
+    conn.execute("""CREATE TRIGGER advToDo_fts_insert AFTER INSERT ON advToDo BEGIN
+            INSERT INTO advToDo_fts(rowid, name, description)
+            VALUES (new.id, new.name, new.description);
+        END""")
+    conn.execute("""CREATE TRIGGER advToDo_fts_delete AFTER DELETE ON advToDo BEGIN
+            INSERT INTO advToDo_fts(advToDo_fts, rowid, name, description)
+            VALUES ('delete', old.id, old.name, old.description);
+        END""")
+    # Смена статуса и полей доставки не трогает индекс - только текстовые поля
+    conn.execute("""CREATE TRIGGER advToDo_fts_update AFTER UPDATE OF name, description ON advToDo BEGIN
+            INSERT INTO advToDo_fts(advToDo_fts, rowid, name, description)
+            VALUES ('delete', old.id, old.name, old.description);
+            INSERT INTO advToDo_fts(rowid, name, description)
+            VALUES (new.id, new.name, new.description);
+        END""")
+    conn.execute("INSERT INTO advToDo_fts(advToDo_fts) VALUES ('rebuild')")
+
+
+def _recipient_index(conn):
+    """Индекс для выборки писем одному адресату (режим дайджеста)"""
+    conn.execute(
+        "CREATE INDEX idx_email_jobs_recipient_status ON email_jobs(recipient, status, run_at)"
+    )
+
+
+def _recurrence(conn):
+    """Правило повтора (RRULE) и время первого наступления"""
+    conn.execute("ALTER TABLE advToDo ADD COLUMN recurrence TEXT")
+    conn.execute("ALTER TABLE advToDo ADD COLUMN dtstart INTEGER")
+
+
+def _export_watermarks(conn):
+    """Отметки инкрементального экспорта: последний выгруженный id для каждого файла"""
+    conn.execute("""CREATE TABLE export_watermarks
+        (
+            target TEXT PRIMARY KEY,
+            last_id INTEGER NOT NULL,
+            updated_at INTEGER NOT NULL
+        )
+        """)
+
+
+def _leases(conn):
+    """Аренда писем: какой экземпляр отправляет письмо и до какого времени"""
+    conn.execute("ALTER TABLE email_jobs ADD COLUMN lease_owner TEXT")
+    conn.execute("ALTER TABLE email_jobs ADD COLUMN lease_expires INTEGER")
+    # Прерванные до миграции отправки сразу доступны другим экземплярам
+    conn.execute("UPDATE email_jobs SET lease_expires = 0 WHERE status = 'sending'")
+    conn.execute(
+        "CREATE INDEX idx_email_jobs_status_lease ON email_jobs(status, lease_expires)"
+    )
+
+
+def _prerendered_messages(conn):
+    """Готовое MIME-письмо, собранное при планировании"""
+    conn.execute("ALTER TABLE email_jobs ADD COLUMN message BLOB")
+
+
+def _recipient_groups(conn):
+    """Группы адресатов и статус доставки рассылки каждому адресату"""
+    conn.execute("""CREATE TABLE recipient_groups
+        (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        )
+        """)
+    conn.execute("""CREATE TABLE group_members
+        (
+            group_id INTEGER NOT NULL REFERENCES recipient_groups(id) ON DELETE CASCADE,
+            email TEXT NOT NULL,
+            PRIMARY KEY (group_id, email)
+        ) WITHOUT ROWID
+        """)
+    conn.execute("ALTER TABLE email_jobs ADD COLUMN group_id INTEGER REFERENCES recipient_groups(id)")
+    conn.execute("""CREATE TABLE email_deliveries
+        (
+            job_id INTEGER NOT NULL REFERENCES email_jobs(id) ON DELETE CASCADE,
+            recipient TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            sent_at INTEGER,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            PRIMARY KEY (job_id, recipient)
+        ) WITHOUT ROWID
+        """)
+
+
+# Порядок важен: номер версии = индекс миграции + 1
+MIGRATIONS = [
+    _legacy_table,
+    _typed_schema,
+    _email_jobs,
+    _delivery_state,
+    _full_text_search,
+    _recipient_index,
+    _recurrence,
+    _export_watermarks,
+    _leases,
+    _prerendered_messages,
+    _recipient_groups,
+]
+
+
+def schema_version():
+    with connection() as conn:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate():
+    """Доводит базу до последней версии схемы"""
+    for number, migration in enumerate(MIGRATIONS, start=1):
+        if schema_version() >= number:
+            continue
+        with transaction() as conn:
+            # Повторная проверка под блокировкой: другой процесс мог успеть первым
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= number:
+                continue
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+        logging.info(f"База данных обновлена до версии {number}")
+    return len(MIGRATIONS)
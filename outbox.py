@@ -0,0 +1,464 @@
+"""Асинхронная очередь исходящих писем.
+
+Задачи планировщика только ставят письмо в очередь (статус queued в таблице
+email_jobs), поэтому очередь переживает перезапуск, а поток планировщика не
+ждёт SMTP. Диспетчер на asyncio в отдельном потоке разбирает очередь: не
+больше concurrency писем одновременно, ограничение частоты для каждого
+провайдера и повторы с экспоненциальной задержкой. Итог доставки
+записывается в строку письма и в строку напоминания.
+
+В режиме дайджеста (digest_window > 0) вместе с наступившим письмом
+забираются остальные письма тому же адресату, которые уже готовы или
+наступят в течение окна, и уходят одним письмом со списком напоминаний -
+одна SMTP-отправка и один токен лимита частоты вместо нескольких.
+
+С одной базой могут работать несколько экземпляров (процессов или машин
+с общим файлом базы). Письмо забирается атомарно вместе с арендой:
+lease_owner - идентификатор экземпляра, lease_expires - до какого времени
+письмо за ним. Пока письмо отправляется, аренда продлевается каждые
+LEASE_TTL / 3 секунд; письмо с истёкшей арендой (экземпляр упал или
+завис) забирает любой другой экземпляр. Итог отправки записывает только
+текущий арендатор. Письмо, уже отправленное упавшим экземпляром, но не
+отмеченное в базе, будет отправлено повторно - окно для этого равно
+времени между SMTP-ответом и коммитом отметки.
+
+Письмо группе адресатов (group_id) в момент отправки разворачивается в
+строки email_deliveries - по одной на участника - и уходит пачками по
+FANOUT_BATCH адресатов: одно письмо, несколько RCPT TO в одной
+SMTP-транзакции через общий пул сессий. Лимит частоты расходуется на
+каждого адресата. Статус доставки хранится для каждого адресата; при
+повторной попытке письмо уходит только тем, кому ещё не ушло.
+"""
+import asyncio
+import logging
+import os
+import random
+import smtplib
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+import mail_transport
+import metrics
+
+
+CONCURRENCY = 3
+RATE_PER_MINUTE = int(os.getenv('ADVTODO_RATE_PER_MINUTE', '60'))  # адресатов в минуту на провайдера
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 30         # задержка перед первым повтором, сек
+BACKOFF_MAX = 3600
+IDLE_POLL = 30            # как часто проверять очередь без явного сигнала, сек
+ERROR_BACKOFF = 1         # пауза цикла после ошибки базы, удваивается до IDLE_POLL
+DIGEST_WINDOW = int(os.getenv('ADVTODO_DIGEST_WINDOW', '0'))  # сек, 0 - без дайджестов
+MAX_DIGEST_SIZE = 50
+FANOUT_BATCH = 50         # адресатов рассылки в одной SMTP-транзакции
+LEASE_TTL = 60            # аренда забранного письма, сек
+MARK_SENT_ATTEMPTS = 4    # попыток записать отметку об отправке (база занята)
+MARK_SENT_DELAY = 0.5     # пауза перед первым повтором отметки, сек
+WORKER_ID = os.getenv('ADVTODO_WORKER_ID')
+
+
+def backoff_delay(attempt):
+    """Экспоненциальная задержка перед попыткой attempt + 1 (с разбросом ±20%)"""
+    delay = min(BACKOFF_BASE * 2 ** (attempt - 1), BACKOFF_MAX)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def deliver_job(job):
+    """Отправляет письмо из строки email_jobs через общий пул SMTP-сессий"""
+    transport = mail_transport.get_transport()
+    if job['message'] is not None:
+        # Письмо собрано при планировании - остаётся только передать байты
+        transport.send(job['message'], job['recipient'])
+        return
+    transport.send(mail_transport.build_message(
+        transport.sender, job['recipient'], job['subject'], job['body']
+    ))
+
+
+def deliver_batch(job, recipients):
+    """Передаёт письмо рассылки пачке адресатов; возвращает отказы {адрес: (код, ответ)}"""
+    transport = mail_transport.get_transport()
+    message = job['message']
+    if message is None:
+        message = mail_transport.render_message(
+            transport.sender, mail_transport.UNDISCLOSED_RECIPIENTS, job['subject'], job['body']
+        )
+    try:
+        return transport.send(message, recipients)
+    except smtplib.SMTPRecipientsRefused as e:
+        # Сервер отказал всем адресатам пачки - это итог по каждому из них
+        return e.recipients
+
+
+def build_digest(jobs):
+    """Одно письмо из нескольких напоминаний одному адресату"""
+    jobs = sorted(jobs, key=lambda job: job['run_at'])
+    return {
+        'id': jobs[0]['id'],
+        'recipient': jobs[0]['recipient'],
+        'subject': f"Напоминания ({len(jobs)})",
+        'body': "<hr>".join(job['body'] for job in jobs),
+        'message': None,
+    }
+
+
+def default_worker_id():
+    """Уникальный идентификатор экземпляра: хост, процесс и случайный суффикс"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+def smtp_provider(job):
+    return mail_transport.get_transport().host
+
+
+class RateLimiter:
+    """Token bucket: не больше rate_per_minute событий в минуту"""
+
+    def __init__(self, rate_per_minute):
+        self.rate = rate_per_minute / 60
+        self.capacity = max(1.0, rate_per_minute / 60)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class OutboxDispatcher:
+    def __init__(self, deliver=deliver_job, provider=smtp_provider,
+                 concurrency=CONCURRENCY, rate_per_minute=RATE_PER_MINUTE,
+                 max_attempts=MAX_ATTEMPTS, digest_window=DIGEST_WINDOW,
+                 on_sent=None, on_failed=None, worker_id=WORKER_ID, lease_ttl=LEASE_TTL,
+                 deliver_batch=deliver_batch, fanout_batch=FANOUT_BATCH):
+        self.deliver = deliver
+        self.deliver_batch = deliver_batch
+        self.fanout_batch = fanout_batch
+        self.provider = provider
+        self.concurrency = concurrency
+        self.rate_per_minute = rate_per_minute
+        self.max_attempts = max_attempts
+        self.digest_window = digest_window
+        # Суффикс различает процессы, запущенные с одним ADVTODO_WORKER_ID
+        self.worker_id = f"{worker_id}:{uuid.uuid4().hex[:6]}" if worker_id else default_worker_id()
+        self.lease_ttl = lease_ttl
+        # Сколько дайджестов отправлено и сколько отдельных писем они заменили
+        self.digests_sent = 0
+        self.messages_saved = 0
+        # on_sent(job) и on_failed(job, error) вызываются из потока диспетчера
+        self.on_sent = on_sent
+        self.on_failed = on_failed
+        self._limiters = {}
+        self._loop = None
+        self._wakeup = None
+        self._stopping = False
+        self._ready = threading.Event()
+        self._thread = None
+
+    def start(self):
+        # Письма, прерванные прошлым запуском, вернутся по истечении их аренды
+        logging.info(f"Диспетчер писем {self.worker_id}")
+        self._thread = threading.Thread(target=self._run, name='outbox', daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    def stop(self, timeout=10):
+        """Останавливает диспетчер, дожидаясь писем, которые уже отправляются"""
+        if self._thread is None:
+            return
+        self._stopping = True
+        self.wake()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def enqueue(self, job_id):
+        """Ставит письмо в очередь (вызывается задачей планировщика)"""
+        if database.enqueue_job(job_id):
+            self.wake()
+
+    def enqueue_overdue(self, until):
+        count = database.enqueue_overdue_jobs(until)
+        if count:
+            self.wake()
+        return count
+
+    def wake(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _run(self):
+        asyncio.run(self._main())
+
+    async def _main(self):
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._ready.set()
+        executor = ThreadPoolExecutor(self.concurrency, thread_name_prefix='smtp')
+        in_flight = {}  # задача -> id отправляемых ею писем
+        heartbeat = asyncio.create_task(self._heartbeat(in_flight))
+
+        def done(task):
+            in_flight.pop(task, None)
+            if not task.cancelled() and task.exception() is not None:
+                logging.error("Ошибка при отправке писем", exc_info=task.exception())
+
+        error_delay = ERROR_BACKOFF
+        try:
+            while not self._stopping:
+                self._wakeup.clear()
+                free = self.concurrency - len(in_flight)
+                try:
+                    if free > 0:
+                        now = time.time()
+                        claimed = await self._db(
+                            database.claim_ready_jobs,
+                            now, free, self.worker_id, now + self.lease_ttl
+                        )
+                        for jobs in await self._batches(claimed):
+                            task = asyncio.create_task(self._deliver(jobs, executor))
+                            in_flight[task] = [job['id'] for job in jobs]
+                            task.add_done_callback(done)
+                    # Без свободных слотов ждём завершения отправки - она разбудит цикл
+                    timeout = await self._idle_timeout() if free > 0 else IDLE_POLL
+                    error_delay = ERROR_BACKOFF
+                except Exception:
+                    # База занята другим экземпляром и т.п. - цикл не должен умереть
+                    logging.exception(f"Ошибка очереди писем, повтор через {error_delay:g} с")
+                    timeout, error_delay = error_delay, min(error_delay * 2, IDLE_POLL)
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            if in_flight:
+                await asyncio.gather(*in_flight, return_exceptions=True)
+            # Забранные, но не начатые письма сразу отдаём другим экземплярам
+            try:
+                await self._db(database.release_leases, self.worker_id)
+            except Exception:
+                logging.exception("Не удалось вернуть в очередь арендованные письма")
+        finally:
+            heartbeat.cancel()
+            executor.shutdown(wait=False)
+            self._loop = None
+
+    async def _heartbeat(self, in_flight):
+        """Продлевает аренду писем, пока они отправляются.
+
+        Только тех, что действительно в работе: забранные, но брошенные
+        письма (например, после сбоя цикла) должны перейти другим.
+        """
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3)
+            job_ids = [job_id for ids in in_flight.values() for job_id in ids]
+            if job_ids:
+                try:
+                    await self._db(
+                        database.renew_leases,
+                        self.worker_id, time.time() + self.lease_ttl, job_ids
+                    )
+                except Exception:
+                    logging.exception("Не удалось продлить аренду писем")
+
+    async def _db(self, fn, *args):
+        """Вызов database.* в потоке: ожидание занятой базы не должно
+        останавливать цикл событий (и вместе с ним продление аренды)"""
+        return await self._loop.run_in_executor(None, fn, *args)
+
+    async def _idle_timeout(self):
+        next_attempt = await self._db(database.next_attempt_at)
+        if next_attempt is None:
+            return IDLE_POLL
+        return min(max(next_attempt - time.time(), 0.05), IDLE_POLL)
+
+    async def _batches(self, claimed):
+        """Группирует забранные письма: по одному или дайджестами по адресату"""
+        if not self.digest_window:
+            return [[job] for job in claimed]
+        batches = []
+        groups = {}
+        for job in claimed:
+            if job['group_id'] is not None:
+                # Рассылки группам в дайджесты не объединяются
+                batches.append([job])
+            else:
+                groups.setdefault(job['recipient'], []).append(job)
+        now = time.time()
+        for recipient, jobs in groups.items():
+            if len(jobs) < MAX_DIGEST_SIZE:
+                jobs.extend(await self._db(
+                    database.claim_digest_jobs,
+                    recipient, now, jobs[0]['run_at'] + self.digest_window,
+                    MAX_DIGEST_SIZE - len(jobs), self.worker_id, now + self.lease_ttl
+                ))
+        return batches + list(groups.values())
+
+    def _limiter(self, job):
+        provider = self.provider(job)
+        if provider not in self._limiters:
+            self._limiters[provider] = RateLimiter(self.rate_per_minute)
+        return self._limiters[provider]
+
+    async def _deliver(self, jobs, executor):
+        if jobs[0]['group_id'] is not None:
+            try:
+                await self._fan_out(jobs[0], executor)
+            finally:
+                self._wakeup.set()
+            return
+        message = jobs[0] if len(jobs) == 1 else build_digest(jobs)
+        started = time.perf_counter()
+        try:
+            await self._limiter(message).acquire()
+            await self._loop.run_in_executor(executor, self.deliver, message)
+        except Exception as e:
+            for job in jobs:
+                await self._handle_error(job, e)
+        else:
+            marked = await self._mark_sent(jobs)
+            if marked is None:
+                return
+            if len(marked) < len(jobs):
+                logging.warning(
+                    f"Аренда {len(jobs) - len(marked)} писем на {message['recipient']} "
+                    f"истекла во время отправки и перешла другому экземпляру"
+                )
+            jobs = marked
+            metrics.delivery_time.observe(time.perf_counter() - started)
+            metrics.emails_sent.inc(len(jobs))
+            now = time.time()
+            for job in jobs:
+                metrics.schedule_lag.observe(max(now - job['run_at'], 0))
+            if len(jobs) > 1:
+                self.digests_sent += 1
+                self.messages_saved += len(jobs) - 1
+                metrics.messages_saved.inc(len(jobs) - 1)
+                logging.info(
+                    f"Дайджест из {len(jobs)} напоминаний отправлен на {message['recipient']} "
+                    f"(сэкономлено писем: {self.messages_saved})"
+                )
+            else:
+                logging.info(f"Письмо успешно отправлено на {message['recipient']}")
+            if self.on_sent is not None:
+                for job in jobs:
+                    self.on_sent(job)
+        finally:
+            self._wakeup.set()
+
+    async def _fan_out(self, job, executor):
+        """Рассылка группе: пачками по fanout_batch адресатов"""
+        started = time.perf_counter()
+        recipients = await self._db(database.expand_group_job, job)
+        limiter = self._limiter(job)
+        # error - последняя ошибка пачки; retry_error - только временная, по ней
+        # решается повтор: 5xx другой пачки не должен провалить ожидающих адресатов
+        error = retry_error = None
+        for start in range(0, len(recipients), self.fanout_batch):
+            batch = recipients[start:start + self.fanout_batch]
+            for _ in batch:
+                await limiter.acquire()
+            try:
+                refused = await self._loop.run_in_executor(
+                    executor, self.deliver_batch, job, batch
+                )
+            except Exception as e:
+                error = e
+                if mail_transport.is_permanent_error(e):
+                    await self._db(database.mark_deliveries, job['id'], (), (),
+                                   [(r, str(e)) for r in batch])
+                    metrics.fanout_recipients.inc(len(batch), status='failed')
+                    continue
+                # Сессия недоступна - остальные пачки уйдут при повторной попытке
+                retry_error = e
+                await self._db(database.mark_deliveries, job['id'], (),
+                               [(r, str(e)) for r in batch])
+                metrics.fanout_recipients.inc(len(batch), status='retry')
+                break
+            retry, failed = [], []
+            for recipient, (code, response) in refused.items():
+                reason = f"{code} {response.decode(errors='replace')}"
+                (failed if code >= 500 else retry).append((recipient, reason))
+            sent = [recipient for recipient in batch if recipient not in refused]
+            await self._db(database.mark_deliveries, job['id'], sent, retry, failed)
+            for status, items in (('sent', sent), ('retry', retry), ('failed', failed)):
+                if items:
+                    metrics.fanout_recipients.inc(len(items), status=status)
+
+        counts = await self._db(database.delivery_counts, job['id'])
+        if not counts:
+            await self._handle_error(job, ValueError(f"В группе {job['recipient']} нет адресатов"),
+                               permanent=True)
+        elif counts.get('pending'):
+            await self._handle_error(job, retry_error or RuntimeError(
+                f"Рассылка {job['recipient']}: не доставлено адресатам: {counts['pending']}"
+            ))
+        elif not counts.get('sent'):
+            await self._handle_error(job, error or RuntimeError(
+                f"Рассылка {job['recipient']}: все адресаты отклонены"
+            ), permanent=True)
+        elif await self._mark_sent([job]):
+            metrics.delivery_time.observe(time.perf_counter() - started)
+            metrics.emails_sent.inc()
+            metrics.schedule_lag.observe(max(time.time() - job['run_at'], 0))
+            logging.info(
+                f"Рассылка группе {job['recipient']}: доставлено {counts['sent']}, "
+                f"отклонено {counts.get('failed', 0)}"
+            )
+            if self.on_sent is not None:
+                self.on_sent(job)
+
+    async def _mark_sent(self, jobs):
+        """Отмечает письма отправленными, повторяя при ошибке базы.
+
+        Письмо уже ушло, поэтому ошибку записи нельзя считать ошибкой
+        отправки. Пока идут повторы, аренда продлевается; если отметить
+        так и не удалось, возвращает None - после истечения аренды письмо
+        будет отправлено повторно.
+        """
+        delay = MARK_SENT_DELAY
+        for attempt in range(1, MARK_SENT_ATTEMPTS + 1):
+            try:
+                return await self._db(database.mark_jobs_sent, jobs)
+            except Exception as e:
+                if attempt == MARK_SENT_ATTEMPTS:
+                    logging.error(
+                        f"Не удалось отметить отправку {len(jobs)} писем на "
+                        f"{jobs[0]['recipient']}: {e}; после истечения аренды они "
+                        f"будут отправлены повторно", exc_info=e
+                    )
+                    return None
+                logging.warning(
+                    f"Не удалось отметить отправку писем на {jobs[0]['recipient']} "
+                    f"(попытка {attempt}), повтор через {delay:g} с: {e}"
+                )
+                await asyncio.sleep(delay)
+                delay *= 2
+
+    async def _handle_error(self, job, error, permanent=False):
+        attempt = job['attempts'] + 1
+        permanent = permanent or mail_transport.is_permanent_error(error)
+        if attempt >= self.max_attempts or permanent:
+            if job['group_id'] is not None:
+                await self._db(database.fail_pending_deliveries, job['id'], str(error))
+            await self._db(database.mark_job_failed, job, str(error))
+            metrics.emails_failed.inc()
+            logging.error(f"Письмо на {job['recipient']} не отправлено: {error}", exc_info=error)
+            if self.on_failed is not None:
+                self.on_failed(job, error)
+            return
+        delay = backoff_delay(attempt)
+        await self._db(database.mark_job_retry, job, time.time() + delay, str(error))
+        metrics.emails_retried.inc()
+        logging.warning(
+            f"Ошибка отправки на {job['recipient']} (попытка {attempt}), "
+            f"повтор через {delay:.0f} с: {error}"
+        )
@@ -0,0 +1,76 @@
+"""Кэш размеченных страниц PDF-экспорта.
+
+Фрагмент истории (несколько сотен - тысяч подряд идущих напоминаний)
+размечается в страницы один раз; результат хранится на диске в
+.export_cache под ключом - хешем содержимого строк фрагмента, версии
+разметки и шрифтов. При следующем экспорте неизменившиеся фрагменты
+берутся из кэша, а заново размечаются только новые и изменённые.
+После экспорта удаляются записи, которые в нём не использовались, так
+что кэш не растёт больше одной (последней) выгрузки.
+"""
+import hashlib
+import logging
+import os
+import pickle
+import zlib
+
+import font_cache
+
+
+EXPORT_CACHE_DIR = os.path.join(font_cache.BASE_DIR, '.export_cache')
+
+# Меняется при любом изменении вида страницы (write_reminder, footer, поля)
+LAYOUT_VERSION = 2
+
+
+class PageCache:
+    def __init__(self, directory=EXPORT_CACHE_DIR, layout_version=LAYOUT_VERSION):
+        self.directory = directory
+        fonts = ','.join(font_cache.font_hash(path) for _, _, path in font_cache.FONTS)
+        self._salt = f"{layout_version}:{fonts}".encode()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, rows):
+        digest = hashlib.sha1(self._salt)
+        for row in rows:
+            digest.update(repr(tuple(row)).encode('utf-8'))
+            digest.update(b'\n')
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.pages")
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                fragment = pickle.loads(zlib.decompress(f.read()))
+        except (OSError, zlib.error, pickle.UnpicklingError, EOFError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return fragment
+
+    def put(self, key, fragment):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp = f"{self._path(key)}.tmp"
+            with open(tmp, 'wb') as f:
+                f.write(zlib.compress(pickle.dumps(fragment, pickle.HIGHEST_PROTOCOL), 1))
+            os.replace(tmp, self._path(key))
+        except OSError:
+            logging.warning("Не удалось сохранить страницы в кэш экспорта", exc_info=True)
+
+    def retain(self, keys):
+        """Удаляет записи, не вошедшие в последний экспорт"""
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        keep = {f"{key}.pages" for key in keys}
+        for name in names:
+            if name not in keep:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
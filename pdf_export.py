@@ -0,0 +1,384 @@
+"""Экспорт истории напоминаний в PDF.
+
+Строки читаются из курсора пачками и сразу выводятся в документ, поэтому
+история никогда не загружается целиком. ExportWorker выполняет экспорт в
+отдельном QThread, сообщает о прогрессе сигналом и поддерживает отмену.
+
+Большие истории размечаются параллельно (render_pdf_parallel): пачки строк
+по порядку раздаются пулу процессов, каждый процесс размечает свою пачку
+в страницы (потоки содержимого fpdf и набор использованных символов),
+а родительский процесс склеивает страницы по порядку в один документ,
+проставляет сквозные номера страниц и один раз встраивает шрифты.
+Размеченные фрагменты сохраняются в кэше страниц (page_cache.py), и при
+повторном экспорте заново размечаются только новые и изменённые.
+"""
+import multiprocessing
+import os
+import threading
+import zlib
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from datetime import datetime
+
+from fpdf import FPDF
+from fpdf.php import UTF8ToUTF16BE
+from PyQt5 import QtCore
+
+import font_cache
+from page_cache import PageCache
+from database import EXPORT_CHUNK_SIZE, count_reminders, from_epoch, iter_reminders_for_export
+
+
+# Параллельная разметка: сколько строк в одном фрагменте и с какого
+# размера истории она включается; ADVTODO_EXPORT_WORKERS=1 - всегда
+# последовательно, без пула процессов (кэш страниц при этом работает)
+FRAGMENT_ROWS = 2000
+PARALLEL_THRESHOLD = 5000
+EXPORT_WORKERS = int(os.getenv('ADVTODO_EXPORT_WORKERS', '0')) or os.cpu_count() or 1
+# Повторный экспорт большой истории переиспользует размеченные страницы
+EXPORT_CACHE = os.getenv('ADVTODO_EXPORT_CACHE', '1') != '0'
+
+# Номер страницы во фрагменте неизвестен до склейки - временно пишем метку.
+# Метка не должна встречаться в тексте напоминаний; к тому же заменяется
+# только последнее вхождение на странице - колонтитул выводится последним
+PAGE_ALIAS = '{advtodo:page}'
+
+
+# Подмножества глифов переиспользуются между экспортами
+font_cache.install()
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+class OutputBuffer:
+    """Буфер вывода fpdf без квадратичной склейки строк.
+
+    fpdf собирает весь файл через self.buffer += s, и каждая такая склейка
+    копирует уже готовую часть документа. Здесь куски копятся в списке,
+    а длина (по ней fpdf считает смещения объектов) ведётся отдельно.
+    """
+
+    def __init__(self):
+        self._parts = []
+        self._length = 0
+
+    def __iadd__(self, s):
+        self._parts.append(s)
+        self._length += len(s)
+        return self
+
+    def __len__(self):
+        return self._length
+
+    def __str__(self):
+        return ''.join(self._parts)
+
+    def encode(self, encoding):
+        return str(self).encode(encoding)
+
+
+class PDF(font_cache.FontCacheMixin, FPDF):
+    def __init__(self, page_alias=None):
+        super().__init__()
+        self.buffer = OutputBuffer()
+        self.page_alias = page_alias
+        # Шрифты DejaVu с кириллицей берём из кэша, а не разбираем заново
+        self.add_cached_fonts()
+        self.set_auto_page_break(auto=True, margin=15)
+
+    def footer(self):
+        self.set_y(-15)
+        self.set_font('DejaVu', '', 8)
+        page = self.page_alias or self.page_no()
+        self.cell(0, 10, f'Страница {page}', 0, 0, 'C')
+
+    def output(self, name='', dest=''):
+        result = super().output(name, dest)
+        return str(result) if isinstance(result, OutputBuffer) else result
+
+    def finish_pages(self):
+        """Закрывает последнюю страницу, не собирая документ (для фрагментов)"""
+        self.in_footer = 1
+        self.footer()
+        self.in_footer = 0
+        self._endpage()
+
+    def append_pages(self, pages, subsets):
+        """Добавляет размеченные в другом процессе страницы в конец документа"""
+        if self.state == 0:
+            self.open()
+        for content in pages:
+            self.page += 1
+            self.pages[self.page] = content
+        for fontkey, subset in subsets.items():
+            font = self.fonts[fontkey]
+            font['subset'] = sorted(set(font['subset']).union(subset))
+
+    def close_merged(self):
+        """Проставляет номера страниц вместо PAGE_ALIAS и собирает документ"""
+        alias = UTF8ToUTF16BE(PAGE_ALIAS, False)
+        for n in range(1, self.page + 1):
+            head, found, tail = self.pages[n].rpartition(alias)
+            if found:
+                self.pages[n] = head + UTF8ToUTF16BE(str(n), False) + tail
+        for font in self.fonts.values():
+            if 'subset' in font:
+                font['subset'] = sorted(set(font['subset']).union(map(ord, '0123456789')))
+        self.state = 1
+        self._enddoc()
+
+
+def write_reminder(pdf, name, description, deadline):
+    """Выводит одно напоминание: дата, название, описание"""
+    date_str = from_epoch(deadline).strftime("%d.%m.%Y %H:%M")
+
+    # Дата
+    pdf.set_font('DejaVu', 'B', 10)
+    pdf.cell(40, 10, 'Дата:', 0, 0)
+    pdf.set_font('DejaVu', '', 10)
+    pdf.cell(0, 10, date_str, 0, 1)
+
+    # Название
+    pdf.set_font('DejaVu', 'B', 10)
+    pdf.cell(40, 10, 'Название:', 0, 0)
+    pdf.set_font('DejaVu', '', 10)
+    pdf.multi_cell(0, 10, name)
+
+    # Описание
+    pdf.set_font('DejaVu', 'B', 10)
+    pdf.cell(40, 10, 'Описание:', 0, 0)
+    pdf.set_font('DejaVu', '', 10)
+    if description:
+        pdf.multi_cell(0, 10, description)
+    else:
+        pdf.cell(0, 10, 'Нет описания', 0, 1)
+
+    pdf.ln(5)
+
+
+def write_header(pdf, exported_at):
+    # Заголовок
+    pdf.set_font('DejaVu', 'B', 14)
+    pdf.cell(0, 10, 'История напоминаний', 0, 1, 'C')
+    pdf.ln(5)
+
+    # Информация о экспорте
+    pdf.set_font('DejaVu', '', 10)
+    pdf.cell(0, 10, f'Дата экспорта: {exported_at.strftime("%d.%m.%Y %H:%M")}', 0, 1)
+    pdf.ln(10)
+
+
+def render_pdf(file_name, chunks, total, progress=None, cancelled=None):
+    """Строит PDF из пачек строк.
+
+    progress(done, total) вызывается после каждой пачки; если cancelled()
+    вернёт True, экспорт прерывается исключением ExportCancelled.
+    """
+    pdf = PDF()
+    pdf.add_page()
+    write_header(pdf, datetime.now())
+
+    done = 0
+    for rows in chunks:
+        if cancelled is not None and cancelled():
+            raise ExportCancelled()
+        for name, description, deadline in rows:
+            write_reminder(pdf, name, description, deadline)
+        done += len(rows)
+        if progress is not None:
+            progress(done, total)
+
+    pdf.output(file_name)
+    return done
+
+
+def render_fragment(rows, exported_at=None):
+    """Размечает пачку строк в страницы (выполняется в процессе пула).
+
+    Возвращает потоки содержимого страниц и символы, использованные каждым
+    шрифтом; на месте номера страницы стоит PAGE_ALIAS. Заголовок
+    документа выводится только в первом фрагменте (exported_at задан).
+    """
+    pdf = PDF(page_alias=PAGE_ALIAS)
+    pdf.add_page()
+    if exported_at is not None:
+        write_header(pdf, exported_at)
+    for name, description, deadline in rows:
+        write_reminder(pdf, name, description, deadline)
+    pdf.finish_pages()
+    return {
+        'pages': [pdf.pages[n] for n in range(1, pdf.page + 1)],
+        'subsets': {key: font['subset'] for key, font in pdf.fonts.items() if 'subset' in font},
+    }
+
+
+def _fragments(chunks, rows_per_fragment):
+    """Перепаковывает пачки курсора во фрагменты по rows_per_fragment строк"""
+    fragment = []
+    for rows in chunks:
+        fragment.extend(tuple(row) for row in rows)
+        while len(fragment) >= rows_per_fragment:
+            yield fragment[:rows_per_fragment]
+            fragment = fragment[rows_per_fragment:]
+    if fragment:
+        yield fragment
+
+
+def _content_fragments(chunks, rows_per_fragment):
+    """Делит строки на фрагменты по содержимому (content-defined chunking).
+
+    Граница ставится перед строкой, хеш которой делится на rows_per_fragment,
+    поэтому добавленное или изменённое напоминание меняет только свой
+    фрагмент, а соседние сохраняют состав и ключ в кэше страниц.
+    """
+    min_rows = max(rows_per_fragment // 4, 1)
+    max_rows = rows_per_fragment * 4
+    fragment = []
+    for rows in chunks:
+        for row in rows:
+            row = tuple(row)
+            if len(fragment) >= max_rows or (
+                    len(fragment) >= min_rows
+                    and zlib.crc32(repr(row).encode('utf-8')) % rows_per_fragment == 0):
+                yield fragment
+                fragment = []
+            fragment.append(row)
+    if fragment:
+        yield fragment
+
+
+def render_pdf_parallel(file_name, chunks, total, progress=None, cancelled=None,
+                        workers=EXPORT_WORKERS, rows_per_fragment=FRAGMENT_ROWS, cache=None):
+    """Строит PDF, размечая фрагменты по rows_per_fragment строк в пуле процессов.
+
+    Каждый фрагмент начинается с новой страницы. В работе одновременно не
+    больше 2 * workers фрагментов, поэтому строки истории не читаются
+    из базы целиком наперёд. С cache (PageCache) границы фрагментов зависят
+    от содержимого строк, а неизменившиеся фрагменты берутся из кэша;
+    первый фрагмент с заголовком и датой экспорта размечается всегда.
+    При workers <= 1 фрагменты размечаются в этом же процессе.
+    """
+    results = {}
+    sizes = {}
+    keys = {}
+    done = 0
+    exported_at = datetime.now()
+    split = _content_fragments if cache is not None else _fragments
+    pool = None
+    pending = set()
+
+    def collect(finished):
+        nonlocal done
+        for future in finished:
+            results[future.index] = future.result()
+            done += sizes[future.index]
+            if future.index in keys:
+                cache.put(keys[future.index], results[future.index])
+        if progress is not None:
+            progress(done, total)
+
+    try:
+        for index, rows in enumerate(split(chunks, rows_per_fragment)):
+            if cancelled is not None and cancelled():
+                raise ExportCancelled()
+            sizes[index] = len(rows)
+            if cache is not None and index > 0:
+                keys[index] = cache.key(rows)
+                cached = cache.get(keys[index])
+                if cached is not None:
+                    results[index] = cached
+                    done += len(rows)
+                    if progress is not None:
+                        progress(done, total)
+                    continue
+            if workers <= 1:
+                future = Future()
+                future.set_result(render_fragment(rows, exported_at if index == 0 else None))
+                future.index = index
+                collect([future])
+                continue
+            if pool is None:
+                # spawn: fork процесса с Qt и открытыми соединениями SQLite небезопасен
+                pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+            future = pool.submit(render_fragment, rows, exported_at if index == 0 else None)
+            future.index = index
+            pending.add(future)
+            while len(pending) >= 2 * workers:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(finished)
+        while pending:
+            if cancelled is not None and cancelled():
+                raise ExportCancelled()
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            collect(finished)
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=not pending, cancel_futures=True)
+
+    if cache is not None:
+        cache.retain(keys.values())
+    pdf = PDF()
+    if not results:
+        results[0] = render_fragment([], exported_at)
+    for index in range(len(results)):
+        fragment = results.pop(index)
+        pdf.append_pages(fragment['pages'], fragment['subsets'])
+    pdf.close_merged()
+    pdf.output(file_name)
+    return done
+
+
+class ExportWorker(QtCore.QObject):
+    progress = QtCore.pyqtSignal(int, int)   # done, total
+    finished = QtCore.pyqtSignal(str)        # file_name
+    failed = QtCore.pyqtSignal(str)          # error_msg
+    cancelled = QtCore.pyqtSignal()
+    empty = QtCore.pyqtSignal()              # экспортировать нечего
+
+    def __init__(self, file_name, chunk_size=EXPORT_CHUNK_SIZE):
+        super().__init__()
+        self.file_name = file_name
+        self.chunk_size = chunk_size
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        """Можно вызывать из GUI-потока"""
+        self._cancel.set()
+
+    def run(self):
+        chunks = iter_reminders_for_export(self.chunk_size)
+        try:
+            total = count_reminders()
+            if not total:
+                self.empty.emit()
+                return
+            self.progress.emit(0, total)
+            options = {}
+            if total < PARALLEL_THRESHOLD:
+                render = render_pdf
+            elif EXPORT_CACHE:
+                # При EXPORT_WORKERS=1 - последовательно, но с кэшем фрагментов
+                render = render_pdf_parallel
+                options['cache'] = PageCache()
+            elif EXPORT_WORKERS > 1:
+                render = render_pdf_parallel
+            else:
+                render = render_pdf
+            render(
+                self.file_name,
+                chunks,
+                total,
+                progress=self.progress.emit,
+                cancelled=self._cancel.is_set,
+                **options
+            )
+        except ExportCancelled:
+            self.cancelled.emit()
+        except Exception as e:
+            self.failed.emit(str(e))
+        else:
+            self.finished.emit(self.file_name)
+        finally:
+            # Возвращаем соединение в пул из этого же потока
+            chunks.close()
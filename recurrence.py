@@ -0,0 +1,97 @@
+"""Повторяющиеся напоминания.
+
+Правило хранится один раз в строке напоминания в подмножестве синтаксиса
+RRULE (RFC 5545):
+
+    FREQ=DAILY|WEEKLY|MONTHLY[;INTERVAL=n][;COUNT=n][;UNTIL=YYYYMMDD[THHMMSS]]
+
+Повторы не разворачиваются заранее: после срабатывания вычисляется только
+следующее наступление, и то же письмо в email_jobs перепланируется на него.
+Поэтому на одно повторяющееся напоминание всегда приходится одна строка
+и не больше одной задачи планировщика, сколько бы оно ни повторялось.
+
+N-е наступление считается от первого срока (dtstart) в местном времени:
+9:00 остаётся 9:00 после перехода на летнее время, а ежемесячное
+напоминание на 31-е число в коротких месяцах приходится на последний день
+месяца и возвращается к 31-му в длинных.
+"""
+import calendar
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+
+FREQUENCIES = ('DAILY', 'WEEKLY', 'MONTHLY')
+
+Rule = namedtuple('Rule', 'freq interval count until')
+
+
+def parse_rule(text):
+    """Разбирает строку правила; ValueError, если правило некорректно"""
+    parts = {}
+    for part in text.strip().upper().split(';'):
+        if not part:
+            continue
+        key, sep, value = part.partition('=')
+        if not sep:
+            raise ValueError(f"Некорректная часть правила повтора: {part!r}")
+        parts[key] = value
+
+    freq = parts.pop('FREQ', None)
+    if freq not in FREQUENCIES:
+        raise ValueError(f"Неподдерживаемая частота повтора: {freq!r}")
+    interval = int(parts.pop('INTERVAL', 1))
+    count = int(parts['COUNT']) if 'COUNT' in parts else None
+    parts.pop('COUNT', None)
+    until = parts.pop('UNTIL', None)
+    if until is not None:
+        if 'T' in until:
+            until = datetime.strptime(until, '%Y%m%dT%H%M%S')
+        else:
+            # UNTIL без времени включает весь указанный день
+            until = datetime.strptime(until, '%Y%m%d').replace(hour=23, minute=59, second=59)
+    if parts:
+        raise ValueError(f"Неподдерживаемые части правила повтора: {', '.join(parts)}")
+    if interval < 1 or (count is not None and count < 1):
+        raise ValueError("INTERVAL и COUNT должны быть положительными")
+    return Rule(freq, interval, count, until)
+
+
+def _add_months(value, months):
+    month = value.month - 1 + months
+    year = value.year + month // 12
+    month = month % 12 + 1
+    day = min(value.day, calendar.monthrange(year, month)[1])
+    return value.replace(year=year, month=month, day=day)
+
+
+def occurrence(rule, dtstart, n):
+    """Время n-го наступления (n = 1 - сам dtstart)"""
+    steps = (n - 1) * rule.interval
+    if rule.freq == 'DAILY':
+        return dtstart + timedelta(days=steps)
+    if rule.freq == 'WEEKLY':
+        return dtstart + timedelta(weeks=steps)
+    return _add_months(dtstart, steps)
+
+
+def _estimate_index(rule, dtstart, after):
+    """Номер наступления около after - без перебора всех предыдущих"""
+    if rule.freq == 'MONTHLY':
+        months = (after.year - dtstart.year) * 12 + after.month - dtstart.month
+        return max(months // rule.interval, 0) + 1
+    days = rule.interval * (7 if rule.freq == 'WEEKLY' else 1)
+    return max((after - dtstart).days // days, 0) + 1
+
+
+def next_occurrence(rule, dtstart, after):
+    """Первое наступление строго после after или None, если повторы закончились"""
+    n = max(_estimate_index(rule, dtstart, after) - 1, 1)
+    at = occurrence(rule, dtstart, n)
+    while at <= after:
+        n += 1
+        at = occurrence(rule, dtstart, n)
+    if rule.count is not None and n > rule.count:
+        return None
+    if rule.until is not None and at > rule.until:
+        return None
+    return at
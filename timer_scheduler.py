@@ -0,0 +1,86 @@
+"""Планировщик писем с одним таймером.
+
+В отличие от ReminderJobStore здесь нет задачи APScheduler на каждое
+письмо. Один поток спит до времени ближайшего ожидающего письма (запрос
+min(run_at) по индексу status, run_at), затем одним UPDATE переводит в
+очередь outbox все письма, время которых наступило, и снова засыпает.
+В памяти процесса не хранится ничего, что зависит от числа ожидающих
+писем: строки читает только диспетчер, порциями по числу свободных слотов.
+"""
+import logging
+import threading
+import time
+
+import database
+from database import to_epoch
+
+
+IDLE_POLL = 30    # как часто проверять базу без явного сигнала, сек
+MIN_SLEEP = 0.05
+
+
+class TimerScheduler:
+    def __init__(self, outbox, idle_poll=IDLE_POLL):
+        self.outbox = outbox
+        self.idle_poll = idle_poll
+        self._next_due = None
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._stopping = False
+        self._thread = None
+
+    def rehydrate(self):
+        """Запускает таймер; пропущенные за время простоя письма уйдут первым же проходом"""
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='email-timer', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        if self._thread is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def add(self, reminder_id, recipient, run_at, subject, body, message=None, group_id=None):
+        """Сохраняет письмо и будит таймер, если оно раньше ближайшего известного"""
+        job_id = database.add_email_job(
+            reminder_id, recipient, run_at, subject, body, message, group_id
+        )
+        self.register(job_id, run_at)
+        return job_id
+
+    def register(self, job_id, run_at):
+        """Будит таймер ради уже сохранённого письма, если оно раньше ближайшего"""
+        run_at = to_epoch(run_at)
+        with self._lock:
+            if self._next_due is None or run_at < self._next_due:
+                self._next_due = run_at
+                self._wakeup.set()
+
+    def _run(self):
+        while not self._stopping:
+            try:
+                timeout = self._tick()
+            except Exception:
+                logging.exception("Ошибка таймера писем")
+                timeout = self.idle_poll
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+
+    def _tick(self):
+        """Ставит в очередь наступившие письма и возвращает время сна до следующих"""
+        now = time.time()
+        count = self.outbox.enqueue_overdue(now)
+        if count:
+            logging.info(f"Поставлено в очередь писем: {count}")
+        next_due = database.next_run_at()
+        with self._lock:
+            self._next_due = next_due
+        if next_due is None:
+            return self.idle_poll
+        # Письма, добавленные другими процессами, подхватываем не позже idle_poll
+        return min(max(next_due - time.time(), MIN_SLEEP), self.idle_poll)